@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+heatmap_echarts 重复构建耗时，对比类别编码缓存命中前后
+在仓库根目录运行: PYTHONPATH=. python benchmarks/heatmap_bench.py [行数] [类别数]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from chartspy.express import echarts as express
+
+
+def _frame(rows: int, categories: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    x = np.array([f"股票{i:05d}" for i in range(categories)], dtype=object)
+    y = pd.date_range('2020-01-01', periods=categories).strftime('%Y-%m-%d').to_numpy(dtype=object)
+    return pd.DataFrame({'x': x[rng.integers(0, categories, rows)],
+                         'y': y[rng.integers(0, categories, rows)],
+                         'value': rng.normal(size=rows)})
+
+
+def _timeit(func, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(rows: int = 1000000, categories: int = 500):
+    df = _frame(rows, categories)
+
+    def build():
+        return express.heatmap_echarts(df, 'x', 'y', 'value').render_html()
+
+    def codes():
+        express._category_codes(df['x'])
+        express._category_codes(df['y'])
+
+    express._CATEGORY_CODES_CACHE.clear()
+    start = time.perf_counter()
+    build()
+    cold = time.perf_counter() - start
+    print(f"rows={rows} categories={categories}")
+    print(f"heatmap_echarts 首次构建:   {cold * 1000:.1f} ms")
+    print(f"heatmap_echarts 重复构建:   {_timeit(build) * 1000:.1f} ms")
+
+    def uncached_codes():
+        express._CATEGORY_CODES_CACHE.clear()
+        codes()
+
+    print(f"_category_codes 无缓存:     {_timeit(uncached_codes) * 1000:.1f} ms")
+    print(f"_category_codes 缓存命中:   {_timeit(codes) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main(*[int(v) for v in sys.argv[1:3]])
@@ -8,10 +8,11 @@ from .g2plot import G2PLOT, G2PLOT_JS_URL
 from .klinecharts import KlineCharts, KlineCharts_JS_URL
 from .highcharts import HighCharts
 from .tabulator import Tabulator
+from .server import ChartServer
 from . import express
 from . import charts
 
-__all__ = ["Echarts", "G2PLOT", "KlineCharts", "HighCharts", "Tabulator", "Tools", "Js", "Html", "ECHARTS_JS_URL",
+__all__ = ["Echarts", "G2PLOT", "KlineCharts", "HighCharts", "Tabulator", "ChartServer", "Tools", "Js", "Html", "ECHARTS_JS_URL",
            "G2PLOT_JS_URL",
            "KlineCharts_JS_URL", "express", "charts"]
 
@@ -1,13 +1,22 @@
 #!/usr/bin/env python
 # coding=utf-8
+import base64
 import datetime
+import hashlib
 import json
+import pickle
 import re
+from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
 
 FUNCTION_BOUNDARY_MARK = "FUNCTION_BOUNDARY_MARK"
+DF2TREE_CACHE_SIZE = 16
+_DF2TREE_CACHE = OrderedDict()
+FORCE_LAYOUT_CACHE_SIZE = 16
+_FORCE_LAYOUT_CACHE = OrderedDict()
+FUNCTION_SEGMENT_PATTERN = re.compile('"' + FUNCTION_BOUNDARY_MARK + '(.*?)' + FUNCTION_BOUNDARY_MARK + '"', re.S)
 
 
 class Js:
@@ -76,51 +85,595 @@ class Tools(object):
         return df
 
     @staticmethod
-    def df2tree(df: pd.DataFrame = None, category_cols=[], value_col="") -> list:
+    def ticks_to_bars(ticks, time_field: str = "time", price_field: str = "price", volume_field: str = "volume",
+                      freq: str = "1min") -> pd.DataFrame:
+        """
+        tick 数据聚合成 OHLCV K线，全部使用pandas原生分组聚合(first/max/min/last/sum)
+        :param ticks: tick DataFrame, 或者按时间先后分块的DataFrame迭代器，分块输入时内存占用只跟块大小有关
+        :param time_field: 时间列名
+        :param price_field: 成交价列名
+        :param volume_field: 成交量列名
+        :param freq: K线周期 1s/5s/1min/5min 等pandas频率字符串
+        :return: index为K线开始时间的DataFrame, 列 open/high/low/close/volume/amount/vwap, 只包含有tick的K线
+        """
+        if isinstance(ticks, pd.DataFrame):
+            ticks = [ticks]
+        agg = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum', 'amount': 'sum'}
+        parts = []
+        for chunk in ticks:
+            if chunk.shape[0] == 0:
+                continue
+            bar_time = pd.to_datetime(chunk[time_field]).dt.floor(freq)
+            price = chunk[price_field].to_numpy(dtype=float)
+            volume = chunk[volume_field].to_numpy(dtype=float)
+            df = pd.DataFrame({'open': price, 'high': price, 'low': price, 'close': price, 'volume': volume,
+                               'amount': price * volume}, index=bar_time.to_numpy())
+            if not df.index.is_monotonic_increasing:
+                df = df.sort_index(kind='stable')
+            parts.append(df.groupby(level=0, sort=False).agg(agg))
+        if len(parts) == 0:
+            bars = pd.DataFrame(columns=list(agg.keys()), dtype=float, index=pd.DatetimeIndex([]))
+        elif len(parts) == 1:
+            bars = parts[0]
+        else:
+            # 跨块的同一根K线再合并一次
+            bars = pd.concat(parts).groupby(level=0, sort=True).agg(agg)
+        bars.index.name = time_field
+        bars['vwap'] = bars['amount'] / bars['volume'].replace(0, np.nan)
+        return bars
+
+    @staticmethod
+    def bin2d(data, x_field: str, y_field: str, value_field: str = None, bins=100, agg: str = 'count',
+              q: float = 0.5, x_scale: str = None, y_scale: str = None, x_range=None, y_range=None,
+              value_range=None, value_bins: int = 256):
+        """
+        散点数据二维分箱聚合，全部使用numpy向量化计算
+        :param data: DataFrame, 或者DataFrame迭代器(超过内存的数据分块输入，需要指定x_range,y_range)
+        :param x_field: x列
+        :param y_field: y列
+        :param value_field: 聚合的值列 agg=count时可以不提供
+        :param bins: 分箱个数 int 或者 (x分箱个数,y分箱个数)
+        :param agg: count/sum/mean/quantile
+        :param q: agg=quantile 时的分位数
+        :param x_scale: linear/log/datetime 不提供时datetime类型列使用datetime,其他使用linear
+        :param y_scale: linear/log/datetime
+        :param x_range: (最小值,最大值) DataFrame输入时不提供直接取数据范围
+        :param y_range: (最小值,最大值)
+        :param value_range: 分块输入计算quantile需要提供, 分位数在value_bins个值区间的直方图上近似计算
+        :param value_bins: 分块输入计算quantile时值区间个数
+        :return: (grid, x_edges, y_edges) grid形状为(x分箱个数,y分箱个数) 没有数据的格子count/sum为0,mean/quantile为nan
+        """
+        if agg not in ('count', 'sum', 'mean', 'quantile'):
+            raise ValueError("agg 只支持 count/sum/mean/quantile")
+        if agg != 'count' and value_field is None:
+            raise ValueError("agg=%s 需要提供 value_field" % agg)
+        nx, ny = (bins, bins) if isinstance(bins, int) else bins
+        in_memory = isinstance(data, pd.DataFrame)
+        chunks = [data] if in_memory else data
+        if not in_memory and (x_range is None or y_range is None):
+            raise ValueError("分块输入需要提供 x_range 和 y_range")
+        if not in_memory and agg == 'quantile' and value_range is None:
+            raise ValueError("分块输入计算quantile需要提供 value_range")
+        counts = np.zeros(nx * ny, dtype=np.int64)
+        sums = np.zeros(nx * ny) if agg in ('sum', 'mean') else None
+        value_hist = np.zeros(nx * ny * value_bins, dtype=np.int64) if agg == 'quantile' and not in_memory else None
+        grid = None
+        x_lo = x_hi = y_lo = y_hi = None
+        for chunk in chunks:
+            if x_scale is None:
+                x_scale = 'datetime' if 'date' in str(chunk[x_field].dtype) else 'linear'
+            if y_scale is None:
+                y_scale = 'datetime' if 'date' in str(chunk[y_field].dtype) else 'linear'
+            xv = _scale_values(chunk[x_field].to_numpy(), x_scale)
+            yv = _scale_values(chunk[y_field].to_numpy(), y_scale)
+            if x_lo is None:
+                x_lo, x_hi = _scale_values(np.array(x_range), x_scale) if x_range is not None else _finite_range(xv)
+                y_lo, y_hi = _scale_values(np.array(y_range), y_scale) if y_range is not None else _finite_range(yv)
+            xi = _bin_index(xv, x_lo, x_hi, nx)
+            yi = _bin_index(yv, y_lo, y_hi, ny)
+            valid = (xi >= 0) & (yi >= 0)
+            if value_field is not None and agg != 'count':
+                vv = chunk[value_field].to_numpy(dtype=float)
+                valid &= np.isfinite(vv)
+                vv = vv[valid]
+            cell = xi[valid] * ny + yi[valid]
+            counts += np.bincount(cell, minlength=nx * ny)
+            if sums is not None:
+                sums += np.bincount(cell, weights=vv, minlength=nx * ny)
+            elif agg == 'quantile' and in_memory:
+                grid = _grouped_quantile(cell, vv, nx * ny, q)
+            elif agg == 'quantile':
+                vi = _bin_index(vv, value_range[0], value_range[1], value_bins)
+                keep = vi >= 0
+                value_hist += np.bincount(cell[keep] * value_bins + vi[keep], minlength=nx * ny * value_bins)
+        if agg == 'count':
+            grid = counts.astype(float)
+        elif agg == 'sum':
+            grid = sums
+        elif agg == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                grid = np.where(counts > 0, sums / counts, np.nan)
+        elif grid is None:
+            hist = value_hist.reshape(nx * ny, value_bins)
+            cum = hist.cumsum(axis=1)
+            total = cum[:, -1]
+            pos = np.argmax(cum >= np.maximum(q * total, 1)[:, None], axis=1)
+            centers = np.linspace(value_range[0], value_range[1], value_bins + 1)
+            centers = (centers[:-1] + centers[1:]) / 2
+            grid = np.where(total > 0, centers[pos], np.nan)
+        x_edges = _unscale_values(np.linspace(x_lo, x_hi if x_hi > x_lo else x_lo + 1, nx + 1), x_scale)
+        y_edges = _unscale_values(np.linspace(y_lo, y_hi if y_hi > y_lo else y_lo + 1, ny + 1), y_scale)
+        return grid.reshape(nx, ny), x_edges, y_edges
+
+    @staticmethod
+    def df_fingerprint(df: pd.DataFrame) -> str:
+        """
+        DataFrame 内容指纹, 向量化hash每一行再整体md5, 用于缓存计算结果
+        :param df:
+        :return: 指纹字符串
+        """
+        md5 = hashlib.md5(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+        md5.update(str(list(df.columns)).encode("utf-8"))
+        return md5.hexdigest()
+
+    @staticmethod
+    def df2tree(df: pd.DataFrame = None, category_cols=[], value_col="", agg: str = "sum") -> list:
         """
         cat1,cat2,cat3,...,value格式的DataFrame转换成echarts需要的树形结构
+        节点按路径区分，不同父节点下同名子节点互不影响；所有层级的汇总值由叶子层分组结果一次性逐层汇总
+        结果按(数据指纹,列)缓存，缓存的是序列化后的bytes，每次调用返回独立的新list，修改结果不影响缓存
         :param df:
         :param category_cols:
         :param value_col:
+        :param agg: 汇总方式 sum/mean/count
         :return:
         """
-        cols = category_cols
-        df_data = df[category_cols + [value_col]]
-        tmp_dict = {}
-        # 从最底层2个类别列开始处理，依次往左处理
-        for i in range(len(cols) - 1, 0, -1):
-            # c1,c0,v0
-            parent_idx = i - 1
-            child_idx = i
-            df_unit = df_data[[cols[parent_idx], cols[child_idx], value_col]]
-            # c1:set(c0)
-            parent_child_map = df_unit.groupby(cols[parent_idx]).apply(
-                lambda dx: list(dx[cols[child_idx]].unique())).to_dict()
-            # c1:sum(v0)
-            parent_sum_value_dict = df_unit[[cols[parent_idx], value_col]].groupby(cols[parent_idx]).sum()[
-                value_col].to_dict()
-            # 第一次迭代，拼装子结构放到父节点下
-            if i == len(cols) - 1:
-                child_sum_value_dict = df_unit[[cols[child_idx], value_col]].groupby(cols[child_idx]).sum()[
-                    value_col].to_dict()
-                for parent in parent_child_map.keys():
-                    children = []
-                    for child in parent_child_map[parent]:
-                        value = child_sum_value_dict[child]
-                        children.append({'name': child, 'value': value})
-                    tmp_dict[parent] = {'name': parent, 'value': parent_sum_value_dict[parent], 'children': children}
-            else:
-                # 非首次迭代,从tmp_dict中取拼装好的子结构放到父节点下
-                for parent in parent_child_map.keys():
-                    children = []
-                    for child in parent_child_map[parent]:
-                        children.append(tmp_dict[child])
-                    tmp_dict[parent] = {'name': parent, 'value': parent_sum_value_dict[parent], 'children': children}
+        if agg not in ('sum', 'mean', 'count'):
+            raise ValueError("agg 只支持 sum/mean/count")
+        cols = list(category_cols)
+        df_data = df[cols + [value_col]]
+        cache_key = (Tools.df_fingerprint(df_data), tuple(cols), value_col, agg)
+        if cache_key in _DF2TREE_CACHE:
+            _DF2TREE_CACHE.move_to_end(cache_key)
+            return pickle.loads(_DF2TREE_CACHE[cache_key])
+        # 叶子层 sum/count，上层都由叶子层汇总得到，mean = sum/count
+        leaf = df_data.groupby(cols, sort=False)[value_col].agg(['sum', 'count'])
         data = []
-        for cat in df_data[cols[0]].unique():
-            data.append(tmp_dict[cat])
+        parent_level = None
+        parent_nodes = None
+        for depth in range(len(cols)):
+            is_leaf = depth == len(cols) - 1
+            level = leaf if is_leaf else leaf.groupby(level=list(range(depth + 1)), sort=False).sum()
+            if agg == 'sum':
+                values = level['sum'].tolist()
+            elif agg == 'count':
+                values = level['count'].tolist()
+            else:
+                values = (level['sum'] / level['count']).tolist()
+            names = level.index.get_level_values(depth).tolist()
+            if is_leaf:
+                nodes = [{'name': name, 'value': value} for name, value in zip(names, values)]
+            else:
+                nodes = [{'name': name, 'value': value, 'children': []} for name, value in zip(names, values)]
+            if depth == 0:
+                data = nodes
+            else:
+                # 按完整路径找到父节点位置
+                prefix = level.index.droplevel(depth)
+                parent_positions = parent_level.index.get_indexer(prefix).tolist()
+                for node, position in zip(nodes, parent_positions):
+                    parent_nodes[position]['children'].append(node)
+            parent_level = level
+            parent_nodes = nodes
+        # 缓存不可变的bytes，调用方修改返回的list(比如改chart.options)不会污染后续调用
+        _DF2TREE_CACHE[cache_key] = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(_DF2TREE_CACHE) > DF2TREE_CACHE_SIZE:
+            _DF2TREE_CACHE.popitem(last=False)
         return data
 
+    @staticmethod
+    def lazy_tree(tree: list, depth: int = 2) -> tuple:
+        """
+        df2tree结果只保留前depth层，更深的子树按节点路径切成json字符串块，前端下钻时再解析
+        被截断的节点保留汇总value，增加 lazy 字段(节点路径的json字符串)，每个块内部同样只展开depth层
+        :param tree: Tools.df2tree 的返回值，不会被修改
+        :param depth: 首屏展开的层数
+        :return: (截断后的树, {节点路径: 子节点json字符串})
+        """
+        if depth < 1:
+            raise ValueError("depth 至少为1")
+        chunks = {}
+
+        def cut(nodes, path, level):
+            result = []
+            for node in nodes:
+                item = {k: v for k, v in node.items() if k != 'children'}
+                children = node.get('children')
+                if children:
+                    node_path = path + [node['name']]
+                    if level + 1 < depth:
+                        item['children'] = cut(children, node_path, level + 1)
+                    else:
+                        key = json.dumps(node_path, ensure_ascii=False, default=json_type_convert)
+                        item['lazy'] = key
+                        chunks[key] = json.dumps(cut(children, node_path, 0), ensure_ascii=False,
+                                                 separators=(',', ':'), default=json_type_convert)
+                result.append(item)
+            return result
+
+        return cut(tree, [], 0), chunks
+
+    @staticmethod
+    def histogram(data, field: str = None, bins='auto', bin_width: float = None, range=None, log: bool = False,
+                  weight_field: str = None, group_field: str = None) -> pd.DataFrame:
+        """
+        一维直方图分箱计数，numpy向量化计算，只返回分箱边界和计数
+        :param data: DataFrame/Series/ndarray, 或者它们的迭代器(超过内存的数据分块输入，需要提供range，bins不能是字符串规则)
+        :param field: data为DataFrame时的数值列
+        :param bins: 分箱个数int，或者numpy规则 auto/fd/sturges/scott/rice/sqrt/doane，或者分箱边界数组
+        :param bin_width: 固定分箱宽度，优先于bins，log=True时为log10刻度下的宽度
+        :param range: (最小值,最大值) 不提供时取数据范围
+        :param log: 对数分箱，非正数忽略
+        :param weight_field: 权重列，提供时count为权重之和
+        :param group_field: 分组列，每组单独计数
+        :return: DataFrame 列 [group_field,] bin_start, bin_end, count
+        """
+        in_memory = isinstance(data, (pd.DataFrame, pd.Series, np.ndarray))
+        chunks = [data] if in_memory else data
+        edges = search_edges = None
+        if not isinstance(bins, (int, str)):
+            edges = np.asarray(bins, dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                search_edges = np.log10(edges) if log else edges
+        elif not in_memory and (range is None or isinstance(bins, str) and bin_width is None):
+            raise ValueError("分块输入需要提供 range，并且 bins 为分箱个数或者提供 bin_width")
+        totals = OrderedDict()
+        for chunk in chunks:
+            if isinstance(chunk, pd.DataFrame):
+                values = chunk[field].to_numpy(dtype=float)
+                weights = chunk[weight_field].to_numpy(dtype=float) if weight_field is not None else None
+                groups = chunk[group_field] if group_field is not None else None
+            else:
+                values = np.asarray(chunk, dtype=float).ravel()
+                weights = groups = None
+            valid = np.isfinite(values) & (values > 0 if log else True)
+            if edges is None:
+                if range is not None:
+                    lo, hi = range
+                else:
+                    lo, hi = (values[valid].min(), values[valid].max()) if valid.any() else (1, 10)
+                if log:
+                    lo, hi = np.log10(lo), np.log10(hi)
+                if bin_width is not None:
+                    edges = lo + np.arange(int(np.ceil((hi - lo) / bin_width)) + 1) * bin_width
+                    if edges[-1] < hi or len(edges) == 1:
+                        edges = np.append(edges, edges[-1] + bin_width)
+                else:
+                    scaled = np.log10(values[valid]) if log else values[valid]
+                    edges = np.histogram_bin_edges(scaled, bins=bins, range=(lo, hi))
+                # 分箱在log10刻度下进行，边界不经过10**log10(x)往返，最小值/最大值不会因为舍入误差掉出分箱
+                search_edges = edges
+                if log:
+                    edges = 10 ** edges
+            n = len(edges) - 1
+            if log:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    search_values = np.log10(np.where(valid, values, np.nan))
+            else:
+                search_values = values
+            index = np.searchsorted(search_edges, search_values, side='right') - 1
+            index[search_values == search_edges[-1]] = n - 1
+            valid &= (index >= 0) & (index < n)
+            if groups is None:
+                codes, uniques = np.zeros(len(values), dtype=np.int64), [None]
+            else:
+                codes, uniques = pd.factorize(groups)
+                valid &= codes >= 0
+            cell = codes[valid] * n + index[valid]
+            counts = np.bincount(cell, weights=None if weights is None else weights[valid],
+                                 minlength=len(uniques) * n).reshape(len(uniques), n)
+            for label, row in zip(uniques, counts):
+                totals[label] = totals[label] + row if label in totals else row
+        if edges is None:
+            edges = np.array([0.0, 1.0])
+        n = len(edges) - 1
+        result = pd.DataFrame({'bin_start': np.tile(edges[:-1], len(totals)),
+                               'bin_end': np.tile(edges[1:], len(totals)),
+                               'count': np.concatenate(list(totals.values())) if totals else np.zeros(0)})
+        if group_field is not None:
+            result.insert(0, group_field, np.repeat(list(totals.keys()), n))
+        return result
+
+    @staticmethod
+    def top_k(df: pd.DataFrame, key_field: str, weight_field: str, k: int = None, others_name: str = "其他"):
+        """
+        重复key的权重求和，按权重保留前k个(argpartition部分选择)，其余合并成一项
+        :param df:
+        :param key_field: key列
+        :param weight_field: 权重列
+        :param k: 保留个数，None不截断只合并重复key
+        :param others_name: 合并项名称，显示为 "名称(N项)"，None时直接丢弃不合并
+        :return: (DataFrame 列 key_field,weight_field 按权重降序, {'keys':丢弃key个数,'weight':丢弃权重,'ratio':丢弃权重占比})
+        """
+        grouped = df.groupby(key_field, sort=False)[weight_field].sum()
+        keys = grouped.index.to_numpy()
+        weights = grouped.to_numpy()
+        total = float(weights.sum())
+        dropped = {'keys': 0, 'weight': 0.0, 'ratio': 0.0}
+        if k is not None and len(weights) > k:
+            top = np.argpartition(-weights, k - 1)[:k] if k > 0 else np.array([], dtype=np.int64)
+            rest = np.ones(len(weights), dtype=bool)
+            rest[top] = False
+            rest_weight = weights[rest].sum().item()
+            dropped = {'keys': int(rest.sum()), 'weight': rest_weight,
+                       'ratio': rest_weight / total if total else 0.0}
+            keys, weights = keys[top], weights[top]
+        order = np.argsort(-weights, kind='stable')
+        result = pd.DataFrame({key_field: keys[order], weight_field: weights[order]})
+        if dropped['keys'] > 0 and others_name is not None:
+            others = pd.DataFrame({key_field: ["%s(%d项)" % (others_name, dropped['keys'])],
+                                   weight_field: [dropped['weight']]})
+            result = pd.concat([result, others], ignore_index=True)
+        return result, dropped
+
+    @staticmethod
+    def quantile_sketch(df: pd.DataFrame, group_fields: list, value_field: str, points: int = 256) -> pd.DataFrame:
+        """
+        每组数据压缩成points+1个等间隔分位数点(0,1/points,...,1)，一次排序向量化计算
+        最小值、四分位数、中位数、最大值(points为4的倍数时)都精确保留，密度形状近似不变
+        :param df:
+        :param group_fields: 分组列
+        :param value_field: 数值列，nan忽略
+        :param points: 分位数间隔数
+        :return: DataFrame 列为 group_fields + [value_field]，每组points+1行
+        """
+        grouped = df.groupby(group_fields, sort=False)
+        codes = grouped.ngroup().to_numpy()
+        keys = grouped.size().index.to_frame(index=False)
+        values = df[value_field].to_numpy(dtype=float)
+        valid = ~np.isnan(values) & (codes >= 0)
+        qs = np.linspace(0, 1, points + 1)
+        sketch = _grouped_quantile(codes[valid], values[valid], len(keys), qs)
+        result = keys.loc[np.repeat(np.arange(len(keys)), len(qs))].reset_index(drop=True)
+        result[value_field] = sketch.ravel()
+        return result.dropna(subset=[value_field]).reset_index(drop=True)
+
+    @staticmethod
+    def columnar_js(df: pd.DataFrame) -> str:
+        """
+        DataFrame按列编码成js表达式，浏览器执行后还原成records数组，列名不再逐行重复
+        数值列按小端二进制base64编码成TypedArray，重复值多的字符串/日期列编码成字典+下标，其余列输出json数组
+        :param df:
+        :return: js表达式字符串，包含任意字符串内容，只能放在extra_js中，不能包装成Js放进options
+        """
+        columns = {}
+        for name in df.columns:
+            series = df[name]
+            kind = series.dtype.kind if isinstance(series.dtype, (np.dtype, pd.DatetimeTZDtype)) else 'O'
+            if kind == 'f':
+                dtype = '<f4' if series.dtype.itemsize == 4 else '<f8'
+                columns[name] = [dtype[1:], _b64(series.to_numpy(dtype=dtype))]
+            elif kind in 'iu':
+                values = series.to_numpy()
+                if len(values) == 0 or (values.min() >= -2 ** 31 and values.max() < 2 ** 31):
+                    columns[name] = ['i4', _b64(values.astype('<i4'))]
+                else:
+                    columns[name] = ['f8', _b64(values.astype('<f8'))]
+            elif kind == 'b':
+                columns[name] = ['b1', _b64(series.to_numpy().astype('u1'))]
+            elif kind == 'O' and _first_valid_is_container(series):
+                # 数组/对象单元格(比如sparkline)不去重，直接输出json
+                columns[name] = ['json', [v.tolist() if isinstance(v, np.ndarray) else v for v in series]]
+            else:
+                # 先去重，日期只格式化去重后的值
+                codes, uniques = pd.factorize(series)
+                labels = _datetime_strings(pd.Series(uniques)).tolist() if kind == 'M' else list(uniques)
+                if len(labels) * 2 <= len(series):
+                    columns[name] = ['dict', labels, _b64(codes.astype('<i4'))]
+                else:
+                    # 缺失值下标为-1，对应末尾的None
+                    columns[name] = ['json', np.array(labels + [None], dtype=object)[codes].tolist()]
+        data = json.dumps(columns, ensure_ascii=False, separators=(',', ':'), default=json_type_convert)
+        return f"""(function(cols, n){{
+            function bytes(s){{
+                var b = atob(s), a = new Uint8Array(b.length);
+                for (var i = 0; i < b.length; i++) {{ a[i] = b.charCodeAt(i); }}
+                return a.buffer;
+            }}
+            var names = Object.keys(cols);
+            var arrays = names.map(function(k){{
+                var c = cols[k];
+                if (c[0] === 'f8') {{ return new Float64Array(bytes(c[1])); }}
+                if (c[0] === 'f4') {{ return new Float32Array(bytes(c[1])); }}
+                if (c[0] === 'i4') {{ return new Int32Array(bytes(c[1])); }}
+                if (c[0] === 'b1') {{ return Array.from(new Uint8Array(bytes(c[1])), function(v){{ return v === 1; }}); }}
+                if (c[0] === 'dict') {{
+                    var labels = c[1];
+                    return Array.from(new Int32Array(bytes(c[2])), function(v){{ return v < 0 ? null : labels[v]; }});
+                }}
+                return c[1];
+            }});
+            var rows = new Array(n);
+            for (var i = 0; i < n; i++) {{
+                var row = {{}};
+                for (var j = 0; j < names.length; j++) {{ row[names[j]] = arrays[j][i]; }}
+                rows[i] = row;
+            }}
+            return rows;
+        }})({data}, {len(df)})"""
+
+    @staticmethod
+    def voxel_downsample(points: np.ndarray, max_points: int) -> np.ndarray:
+        """
+        点云体素网格降采样，前三列为坐标，每个非空体素输出一个点，所有列取体素内均值
+        网格边长二分搜索，输出点数接近max_points
+        :param points: (n, d) 数值数组 d>=3
+        :param max_points: 输出点数上限
+        :return: (m, d) m<=max_points
+        """
+        points = np.asarray(points, dtype=float)
+        if len(points) <= max_points:
+            return points
+        lo = points[:, :3].min(axis=0)
+        span = points[:, :3].max(axis=0) - lo
+        span[span == 0] = 1
+        scaled = (points[:, :3] - lo) / span
+
+        def voxel_keys(grid):
+            cells = np.minimum((scaled * grid).astype(np.int64), grid - 1)
+            return (cells[:, 0] * grid + cells[:, 1]) * grid + cells[:, 2]
+
+        def occupied(grid):
+            keys = np.sort(voxel_keys(grid))
+            return int(np.count_nonzero(np.diff(keys))) + 1
+
+        # 非空体素数随网格边长增大，边长为max_points立方根时一定不超过，倍增找到上界后对数尺度二分，
+        # 找不超过max_points的最细网格，达到95%就停止
+        low = max(int(max_points ** (1 / 3)), 1)
+        high = low * 2
+        while high < 2 ** 20 and occupied(high) <= max_points:
+            low, high = high, high * 2
+        while high - low > 1:
+            grid = int(round(np.sqrt(low * high)))
+            grid = min(max(grid, low + 1), high - 1)
+            count = occupied(grid)
+            if count > max_points:
+                high = grid
+            else:
+                low = grid
+                if count >= max_points * 0.95:
+                    break
+        voxels, inverse = np.unique(voxel_keys(low), return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(voxels))
+        return np.column_stack([np.bincount(inverse, weights=points[:, i], minlength=len(voxels)) / counts
+                                for i in range(points.shape[1])])
+
+    @staticmethod
+    def bucket_downsample(values: np.ndarray, max_points: int, how: str = 'minmax') -> np.ndarray:
+        """
+        二维数组按行降采样，每行均分成若干桶
+        minmax: 每桶保留最小值和最大值(按出现顺序)，折线形状不丢峰谷; sum: 每桶求和，适合柱状图; mean: 每桶均值
+        :param values: (m, n) 数值数组，每行一条序列，NaN视为缺失
+        :param max_points: 每行输出点数上限
+        :param how: minmax/sum/mean
+        :return: (m, k) k<=max_points, 全部缺失的桶为NaN
+        """
+        values = np.asarray(values, dtype=float)
+        m, n = values.shape
+        if n <= max_points:
+            return values
+        buckets = max(max_points // 2, 1) if how == 'minmax' else max_points
+        size = -(-n // buckets)
+        buckets = -(-n // size)
+        padded = np.full((m, buckets * size), np.nan)
+        padded[:, :n] = values
+        padded = padded.reshape(m, buckets, size)
+        missing = np.isnan(padded)
+        empty = missing.all(axis=2)
+        if how == 'minmax':
+            lo = np.where(missing, np.inf, padded).argmin(axis=2)
+            hi = np.where(missing, -np.inf, padded).argmax(axis=2)
+            first = np.minimum(lo, hi)[..., None]
+            second = np.maximum(lo, hi)[..., None]
+            result = np.concatenate([np.take_along_axis(padded, first, axis=2),
+                                     np.take_along_axis(padded, second, axis=2)], axis=2)
+            return result.reshape(m, buckets * 2)
+        total = np.where(missing, 0, padded).sum(axis=2)
+        if how == 'mean':
+            total = total / np.maximum((~missing).sum(axis=2), 1)
+        elif how != 'sum':
+            raise ValueError(f"不支持的降采样方式: {how}")
+        return np.where(empty, np.nan, total)
+
+    @staticmethod
+    def force_layout(source: np.ndarray, target: np.ndarray, node_count: int, weights: np.ndarray = None,
+                     iterations: int = 100, grid: int = 128, seed: int = 0) -> np.ndarray:
+        """
+        力导向布局(Fruchterman-Reingold)，斥力用网格近似: 节点密度落到grid*grid网格，FFT和斥力核卷积得到斥力场，
+        每轮O(n+m+grid²log grid)；引力沿边计算。结果按(图指纹,参数)缓存，缓存里存只读副本，每次返回新数组
+        :param source: 边起点下标
+        :param target: 边终点下标
+        :param node_count: 节点数
+        :param weights: 边权重，默认1
+        :param iterations: 迭代轮数
+        :param grid: 斥力网格边长
+        :param seed: 初始位置随机种子
+        :return: (node_count, 2) 坐标，范围[0,1000]
+        """
+        source = np.asarray(source, dtype=np.int64)
+        target = np.asarray(target, dtype=np.int64)
+        weights = np.ones(len(source)) if weights is None else np.asarray(weights, dtype=float)
+        md5 = hashlib.md5()
+        for values in (source, target, weights):
+            md5.update(np.ascontiguousarray(values).tobytes())
+        cache_key = (md5.hexdigest(), node_count, iterations, grid, seed)
+        if cache_key in _FORCE_LAYOUT_CACHE:
+            _FORCE_LAYOUT_CACHE.move_to_end(cache_key)
+            return _FORCE_LAYOUT_CACHE[cache_key].copy()
+        # 理想边长为1，初始铺满面积和节点数成正比的正方形
+        size = np.sqrt(max(node_count, 1))
+        pos = np.random.default_rng(seed).uniform(-size / 2, size / 2, (node_count, 2))
+        weights = weights / weights.mean() if len(weights) > 0 and weights.mean() > 0 else weights
+        # 斥力核 k²/d 沿距离方向，2倍网格避免循环卷积回绕
+        offsets = np.fft.fftfreq(2 * grid, 1 / (2 * grid))
+        dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+        d2 = dx ** 2 + dy ** 2
+        d2[0, 0] = 1
+        kernel_x = np.fft.rfft2(dx / d2)
+        kernel_y = np.fft.rfft2(dy / d2)
+        temperature = size / 10
+        for step in range(iterations):
+            lo = pos.min(axis=0)
+            cell = max((pos.max(axis=0) - lo).max() / (grid - 1), 1e-9)
+            index = np.minimum(((pos - lo) / cell).astype(np.int64), grid - 1)
+            flat = index[:, 0] * grid + index[:, 1]
+            density = np.zeros((2 * grid, 2 * grid))
+            density[:grid, :grid] = np.bincount(flat, minlength=grid * grid).reshape(grid, grid)
+            density = np.fft.rfft2(density)
+            # 网格距离换算成实际距离: 斥力 1/d，距离放大cell倍斥力缩小cell倍
+            field_x = np.fft.irfft2(density * kernel_x, s=(2 * grid, 2 * grid))[:grid, :grid].ravel() / cell
+            field_y = np.fft.irfft2(density * kernel_y, s=(2 * grid, 2 * grid))[:grid, :grid].ravel() / cell
+            disp = np.column_stack([field_x[flat], field_y[flat]])
+            # 引力 d²/k，沿边方向
+            delta = pos[target] - pos[source]
+            pull = delta * (np.hypot(delta[:, 0], delta[:, 1]) * weights)[:, None]
+            for axis in (0, 1):
+                disp[:, axis] += np.bincount(source, weights=pull[:, axis], minlength=node_count) - \
+                                 np.bincount(target, weights=pull[:, axis], minlength=node_count)
+            # 向中心的弱引力，不连通的分量不会飞散
+            disp -= pos * (0.05 * np.hypot(pos[:, 0], pos[:, 1]) / size)[:, None]
+            length = np.maximum(np.hypot(disp[:, 0], disp[:, 1]), 1e-9)
+            pos += disp / length[:, None] * np.minimum(length, temperature)[:, None]
+            temperature = size / 10 * (1 - (step + 1) / iterations) + 1e-2
+        lo, hi = pos.min(axis=0), pos.max(axis=0)
+        pos = (pos - lo) / max((hi - lo).max(), 1e-9) * 1000
+        cached = pos.copy()
+        cached.setflags(write=False)
+        _FORCE_LAYOUT_CACHE[cache_key] = cached
+        if len(_FORCE_LAYOUT_CACHE) > FORCE_LAYOUT_CACHE_SIZE:
+            _FORCE_LAYOUT_CACHE.popitem(last=False)
+        return pos
+
+    @staticmethod
+    def float32_data(data) -> Js:
+        """
+        数值数组按float32小端二进制base64编码，浏览器端解码成Float32Array，可以直接作为echarts series data
+        :param data: 数值数组，多维数组按行展开
+        :return: Js
+        """
+        return Js("(function(s){var b=atob(s),a=new Uint8Array(b.length);"
+                  "for(var i=0;i<b.length;i++){a[i]=b.charCodeAt(i);}return new Float32Array(a.buffer);})"
+                  "('%s')" % _b64(np.asarray(data, dtype='<f4').ravel()))
+
+    @staticmethod
+    def compact_data(data) -> Js:
+        """
+        纯数字(嵌套)list 输出成紧凑的json, 不做缩进, 用于数据量很大的series data
+        :param data: 纯数字的list, 不能包含字符串
+        :return: Js
+        """
+        return Js(json.dumps(data, separators=(',', ':'), default=json_type_convert))
+
     @staticmethod
     def convert_js_to_dict(js_code: str, print_dict: bool = True) -> dict:
         """
@@ -184,26 +737,112 @@ class Tools(object):
         :return: JavaScript 对象的字符串表示
         """
         json_str = json.dumps(options, indent=2, default=json_type_convert)
-        code_segments = []
-        function_start = 0
         # 找到所有函数声明的起止位置,处理双引号转移，再把包裹函数的特征串删除
-        mask_length = len(FUNCTION_BOUNDARY_MARK)
-        for i in range(mask_length, len(json_str)):
-            if json_str[i - mask_length - 1:i] == '"' + FUNCTION_BOUNDARY_MARK:
-                function_start = i - mask_length
-            elif json_str[i - mask_length - 1:i] == FUNCTION_BOUNDARY_MARK + '"':
-                code_segments.append([function_start, i])
-        left_index = 0
-        parts = []
-        for seg in code_segments:
-            parts.append(json_str[left_index:seg[0]])
-            parts.append(json_str[seg[0]:(seg[1] + 1)].replace('\\"', '"'))
-            left_index = seg[1] + 1
-        parts.append(json_str[left_index:])
-        dict_str = "".join(parts)
+        dict_str = FUNCTION_SEGMENT_PATTERN.sub(lambda m: m.group(1).replace('\\"', '"'), json_str)
         return re.sub('"?' + FUNCTION_BOUNDARY_MARK + '"?', "", dict_str)
 
 
+def _b64(values: np.ndarray) -> str:
+    """
+    numpy数组的二进制内容转base64字符串
+    """
+    return base64.b64encode(np.ascontiguousarray(values).tobytes()).decode('ascii')
+
+
+def _first_valid_is_container(series: pd.Series) -> bool:
+    """
+    第一个非空单元格是否是数组/对象，开头几行缺失的sparkline列也能识别
+    """
+    for value in series:
+        if isinstance(value, (list, tuple, dict, np.ndarray)):
+            return True
+        if not pd.isna(value):
+            return False
+    return False
+
+
+def _datetime_strings(series: pd.Series) -> pd.Series:
+    """
+    日期列向量化转成字符串，格式和json_type_convert一致: 零点只保留日期，其余isoformat
+    """
+    if series.dt.tz is not None or (series.dt.microsecond != 0).any() or (series.dt.nanosecond != 0).any():
+        return series.map(lambda v: None if pd.isna(v) else json_type_convert(v))
+    midnight = (series.dt.hour + series.dt.minute + series.dt.second) == 0
+    result = series.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    result[midnight] = series[midnight].dt.strftime('%Y-%m-%d')
+    return result
+
+
+def _finite_range(values: np.ndarray) -> tuple:
+    """
+    有限值的(最小值,最大值)，空数据或全部缺失时返回(0,1)，分箱结果为空网格
+    """
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return 0.0, 1.0
+    return finite.min(), finite.max()
+
+
+def _scale_values(values: np.ndarray, scale: str) -> np.ndarray:
+    """
+    分箱前把数值转换到线性空间 log取log10,datetime转成纳秒整数
+    """
+    if scale == 'datetime':
+        times = pd.to_datetime(pd.Series(values)).to_numpy(dtype='datetime64[ns]')
+        result = times.astype(np.int64).astype(float)
+        result[np.isnat(times)] = np.nan
+        return result
+    values = np.asarray(values, dtype=float)
+    if scale == 'log':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(values > 0, np.log10(values), np.nan)
+    return values
+
+
+def _unscale_values(values: np.ndarray, scale: str) -> np.ndarray:
+    """
+    _scale_values 的逆变换
+    """
+    if scale == 'datetime':
+        return np.round(values).astype(np.int64).astype('datetime64[ns]')
+    if scale == 'log':
+        return np.power(10, values)
+    return values
+
+
+def _bin_index(values: np.ndarray, lo: float, hi: float, bins: int) -> np.ndarray:
+    """
+    等宽分箱下标，超出范围和缺失值为-1，最大值落在最后一个箱
+    """
+    width = (hi - lo) if hi > lo else 1
+    with np.errstate(invalid='ignore'):
+        idx = np.floor((values - lo) / width * bins)
+        idx[values == hi] = bins - 1
+        idx[~((idx >= 0) & (idx < bins))] = -1
+    return idx.astype(np.int64)
+
+
+def _grouped_quantile(groups: np.ndarray, values: np.ndarray, group_count: int, q) -> np.ndarray:
+    """
+    按分组精确计算分位数(线性插值)，一次排序向量化完成
+    q 为数组时返回 (group_count, len(q))
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    pos = np.multiply.outer(np.maximum(counts - 1, 0), q)
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.ceil(pos).astype(np.int64)
+    result = np.full(pos.shape, np.nan)
+    has = counts > 0
+    starts = starts.reshape((-1,) + (1,) * (pos.ndim - 1))
+    lo_values = sorted_values[(starts + lower)[has]]
+    hi_values = sorted_values[(starts + upper)[has]]
+    result[has] = lo_values + (hi_values - lo_values) * (pos - lower)[has]
+    return result
+
+
 json_encoder = json.JSONEncoder()
 
 
@@ -233,7 +872,7 @@ def json_type_convert(o: object):
     elif isinstance(o, (np.int_, np.intc, np.intp, np.int8, np.int16, np.int32, np.int64,
                       np.uint8, np.uint16, np.uint32, np.uint64)):
         return int(o)
-    elif isinstance(o, (np.float_, np.float16, np.float32, np.float64,np.complexfloating)):
+    elif isinstance(o, (np.floating, np.complexfloating)):
         return float(o)
     elif isinstance(o, np.character):
         return str(o)
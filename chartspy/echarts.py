@@ -31,6 +31,15 @@ class Echarts(object):
         self.js_url_gl = ECHARTS_GL_JS_URL
         self.extra_js = extra_js
         self.with_gl = with_gl
+        # 图表实例创建后依次调用的js函数名，函数需在extra_js中定义，唯一参数为图表实例
+        self.render_hooks = []
+
+    def render_hooks_js(self) -> str:
+        """
+        生成图表实例创建后调用render_hooks的js语句
+        :return:
+        """
+        return "".join([f"{hook}(plot_{self.plot_id});" for hook in self.render_hooks])
 
     @staticmethod
     def timeline(echarts_dict: dict = {}, visual_map_options=None):
@@ -41,6 +50,7 @@ class Echarts(object):
         :return:
         """
         charts_dict = {k: (v.options if isinstance(v, Echarts) else v) for k, v in echarts_dict.items()}
+        extra_js = "".join([v.extra_js for v in echarts_dict.values() if isinstance(v, Echarts)])
         options = {
             "baseOption": {
                 'timeline': {
@@ -125,7 +135,9 @@ class Echarts(object):
                                 options['baseOption']['visualMap']['max'],
                                 charts_dict[keys[i]]['visualMap']['max'])
 
-        return Echarts(options=options)
+        chart = Echarts(options=options, extra_js=extra_js)
+        chart.render_hooks = [h for v in echarts_dict.values() if isinstance(v, Echarts) for h in v.render_hooks]
+        return chart
 
     def overlap_series(self, other_chart_options: list = [], add_yaxis=False, add_yaxis_grid_index=0):
         """
@@ -136,6 +148,8 @@ class Echarts(object):
         :return:
         """
         this_options = copy.deepcopy(self.options)
+        extra_js = self.extra_js
+        render_hooks = list(self.render_hooks)
         if add_yaxis:
             if type(this_options['yAxis']).__name__=='dict':
                 this_options['yAxis'] = [this_options['yAxis']]
@@ -146,6 +160,8 @@ class Echarts(object):
             this_options["series"] = []
         for chart_option in other_chart_options:
             if isinstance(chart_option, Echarts):
+                extra_js = extra_js + chart_option.extra_js
+                render_hooks.extend(chart_option.render_hooks)
                 chart_option = chart_option.options
             old_series_count = len(this_options["series"])
             this_options["legend"]["data"].extend(chart_option["legend"]["data"])
@@ -163,7 +179,9 @@ class Echarts(object):
                     else:
                         chart_option["visualMap"][i]['seriesIndex'] = old_series_count
                 this_options["visualMap"].extend(chart_option["visualMap"])
-        return Echarts(options=this_options, extra_js=self.extra_js, width=self.width, height=self.height)
+        chart = Echarts(options=this_options, extra_js=extra_js, width=self.width, height=self.height)
+        chart.render_hooks = render_hooks
+        return chart
 
     def print_options(self, drop_data=False):
         """
@@ -214,6 +232,7 @@ class Echarts(object):
                     {plot.extra_js}
                     var options_{plot.plot_id} = {plot.js_options};
                     plot_{plot.plot_id}.setOption(options_{plot.plot_id})
+                    {plot.render_hooks_js()}
                   }});
             </script>
             """
@@ -237,6 +256,7 @@ class Echarts(object):
                     {plot.extra_js}
                     var options_{plot.plot_id} = {plot.js_options};
                     plot_{plot.plot_id}.setOption(options_{plot.plot_id})
+                    {plot.render_hooks_js()}
                   }});
             </script>
             """
@@ -276,6 +296,7 @@ class Echarts(object):
                        var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                        {plot.extra_js}
                        plot_{plot.plot_id}.setOption({plot.js_options})
+                       {plot.render_hooks_js()}
                     }});
                   </script>
                 """
@@ -300,6 +321,7 @@ class Echarts(object):
                     var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                     {plot.extra_js}
                     plot_{plot.plot_id}.setOption({plot.js_options})
+                    {plot.render_hooks_js()}
                 }});
               </script>
             """
@@ -334,6 +356,7 @@ class Echarts(object):
                 var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                 {plot.extra_js}
                 plot_{plot.plot_id}.setOption({plot.js_options})
+                {plot.render_hooks_js()}
               </script>
             </body>
             </html>
@@ -359,6 +382,7 @@ class Echarts(object):
                 var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                 {plot.extra_js}
                 plot_{plot.plot_id}.setOption({plot.js_options})
+                {plot.render_hooks_js()}
               </script>
             </body>
             </html>
@@ -388,6 +412,7 @@ class Echarts(object):
                     var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                     {plot.extra_js}
                     plot_{plot.plot_id}.setOption({plot.js_options})
+                    {plot.render_hooks_js()}
                   </script>
                 </div>
                 """
@@ -406,6 +431,7 @@ class Echarts(object):
                     var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                     {plot.extra_js}
                     plot_{plot.plot_id}.setOption({plot.js_options})
+                    {plot.render_hooks_js()}
                   </script>
                 </div>
                 """
@@ -442,6 +468,7 @@ class Echarts(object):
                 var plot_{plot.plot_id} =
                 echarts.init(document.getElementById('{plot.plot_id}'));
                 plot_{plot.plot_id}.setOption(options_{plot.plot_id})
+                {plot.render_hooks_js()}
               }});
           }}else{{
             new Promise(function(resolve, reject)
@@ -460,6 +487,7 @@ class Echarts(object):
         }}).then(() = > {{
             var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
             plot_{plot.plot_id}.setOption(options_{plot.plot_id})
+            {plot.render_hooks_js()}
         }});
         }}
         </script>
@@ -486,6 +514,7 @@ class Echarts(object):
               require(['echarts'], function (echarts) {{
                 var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                 plot_{plot.plot_id}.setOption(options_{plot.plot_id})
+                {plot.render_hooks_js()}
               }});
           }}else{{
             new Promise(function(resolve, reject) {{
@@ -497,6 +526,7 @@ class Echarts(object):
             }}).then(() => {{
                var plot_{plot.plot_id} = echarts.init(document.getElementById('{plot.plot_id}'));
                plot_{plot.plot_id}.setOption(options_{plot.plot_id})
+               {plot.render_hooks_js()}
             }});
           }}
         </script>
@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 # coding=utf-8
 import copy
+import hashlib
+import json
+import uuid
+from collections import OrderedDict
 
 import pandas as pd
 import numpy as np
 from .. import Echarts
-from ..base import Js, Tools
+from ..base import Js, Tools, json_type_convert, _datetime_strings, FUNCTION_BOUNDARY_MARK
+
+CATEGORY_CODES_CACHE_SIZE = 16
+_CATEGORY_CODES_CACHE = OrderedDict()
 
 # 二维坐标系统基础配置适用  scatter,bar,line
 ECHARTS_BASE_GRID_OPTIONS = {
@@ -140,11 +147,14 @@ def scatter_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str
                     y_field_type: str = None,
                     y_field_log_base: int = 10,
                     y_field_scale: bool = False,
-                    opacity=0.5, tooltip_trigger="axis", title: str = "",
+                    opacity=0.5, tooltip_trigger="axis",
+                    bins=None, bin_agg: str = 'count',
+                    title: str = "",
                     width: str = "100%",
                     height: str = "500px",**kwargs) -> Echarts:
     """
     scatter chart
+    指定bins时为分箱模式，点数太多时在服务端分箱聚合后用热度图显示
 
 
     :param data_frame: 必填 DataFrame
@@ -164,11 +174,19 @@ def scatter_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str
     :param y_field_scale:
     :param opacity:
     :param tooltip_trigger: tooltip 触发类型 axis和 item
+    :param bins: 分箱模式 分箱个数 int 或者 (x分箱个数,y分箱个数)，更多分箱参数参考 heatmap_echarts
+    :param bin_agg: 分箱聚合方式 count/sum/mean/quantile, 聚合color_field列
     :param title: 可选标题
     :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
     :param height: 输出div的高度 支持像素和百分比 比如800px/100%
     :return:
     """
+    if bins is not None:
+        return heatmap_echarts(data_frame, x_field=x_field, y_field=y_field, color_field=color_field,
+                               color_sequence=color_sequence, bins=bins, bin_agg=bin_agg,
+                               x_scale='log' if x_field_type == 'log' else None,
+                               y_scale='log' if y_field_type == 'log' else None,
+                               title=title, width=width, height=height, **kwargs)
     df = data_frame.copy()
     if x_field is None:
         df["x_col_echartspy"] = df.index
@@ -479,7 +497,8 @@ def bar_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str = No
 
 def pie_echarts(data_frame: pd.DataFrame, name_field: str = None, value_field: str = None, rose_type: str = None,
                 title: str = "",
-                width: str = "100%", height: str = "500px",**kwargs) -> Echarts:
+                width: str = "100%", height: str = "500px", top_k: int = None, others_name: str = "其他",
+                **kwargs) -> Echarts:
     """
     饼图
     :param data_frame: 必填 DataFrame
@@ -489,13 +508,21 @@ def pie_echarts(data_frame: pd.DataFrame, name_field: str = None, value_field: s
     :param title: 可选标题
     :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
     :param height: 输出div的高度 支持像素和百分比 比如800px/100%
-    :return:
+    :param top_k: 同名项合并后只保留值最大的top_k项
+    :param others_name: 其余项合并成的一项的名称(排在最后)，None时直接丢弃，丢弃项数和占比显示在副标题
+    :return: Echarts, top_k_dropped 属性记录截断丢弃的 {'keys','weight','ratio'}
     """
-    df = data_frame[[name_field, value_field]].sort_values(name_field, ascending=True).copy()
+    df, dropped = Tools.top_k(data_frame, name_field, value_field, top_k, others_name)
     df.columns = ['name', 'value']
+    if dropped['keys'] > 0 and others_name is not None:
+        df = pd.concat([df.iloc[:-1].sort_values('name', ascending=True), df.iloc[-1:]])
+    else:
+        df = df.sort_values('name', ascending=True)
     options = {
         'title': {
             'text': title,
+            'subtext': "未显示%d项，占比%.2f%%" % (dropped['keys'], dropped['ratio'] * 100)
+            if dropped['keys'] > 0 and others_name is None else "",
         },
         'tooltip': {
             'trigger': 'item',
@@ -515,7 +542,7 @@ def pie_echarts(data_frame: pd.DataFrame, name_field: str = None, value_field: s
             'type': 'scroll',
             'show': True,
             'top': 'top',
-            'data': list(df['name'].unique())
+            'data': df['name'].tolist()
         },
         'series': [
             {
@@ -544,7 +571,9 @@ def pie_echarts(data_frame: pd.DataFrame, name_field: str = None, value_field: s
         ]
     }
     options.update(kwargs)
-    return Echarts(options=options, width=width, height=height)
+    chart = Echarts(options=options, width=width, height=height)
+    chart.top_k_dropped = dropped
+    return chart
 
 def candlestick_echarts(data_frame: pd.DataFrame, time_field: str = 'time', open_field: str = "open",
                         high_field: str = 'high',
@@ -552,7 +581,8 @@ def candlestick_echarts(data_frame: pd.DataFrame, time_field: str = 'time', open
                         close_field: str = 'close',
                         volume_field: str = 'volume', mas: list = [5, 10, 30], log_y: bool = True, title: str = "",
                         width: str = "100%", height: str = "600px", left_padding: str = '0%',
-                        right_padding: str = '3%',text_color:str='#000',**kwargs) -> Echarts:
+                        right_padding: str = '3%',text_color:str='#000', stream_url: str = None,
+                        **kwargs) -> Echarts:
     """
     绘制K线
     :param data_frame:
@@ -569,6 +599,8 @@ def candlestick_echarts(data_frame: pd.DataFrame, time_field: str = 'time', open
     :param height: 输出div的高度 支持像素和百分比 比如800px/100%
     :param left_padding: 左侧padding宽度
     :param right_padding: 右侧padding宽度
+    :param stream_url: 实时K线推送地址(ChartServer.add_bar_stream返回的stream.url)，页面订阅后局部setOption更新最新K线和均线
+                       推送的时间标签按json_type_convert格式，和time_field的格式一致才能合并到同一根K线
     :return:
     """
     df = data_frame.copy()
@@ -808,7 +840,98 @@ def candlestick_echarts(data_frame: pd.DataFrame, time_field: str = 'time', open
         options['series'].append(series_ma)
         options['legend']['data'].append(name)
     options.update(kwargs)
-    return Echarts(options=options, width=width, height=height)
+    if stream_url is None:
+        return Echarts(options=options, width=width, height=height)
+    uid = uuid.uuid4().hex
+    extra_js = f"""
+    function candlestick_stream_{uid}(chart){{
+        var option = chart.getOption();
+        var times = option.xAxis[0].data, candles = option.series[0].data, volumes = option.series[1].data;
+        var mas = {json.dumps(list(mas))}, lines = option.series.slice(2, 2 + mas.length).map(function(s){{ return s.data; }});
+        new EventSource("{stream_url}").onmessage = function(event){{
+            var bars = JSON.parse(event.data);
+            for (var k = 0; k < bars.length; k++) {{
+                var bar = bars[k], i = times.length - 1;
+                if (i < 0 || times[i] < bar.time) {{
+                    i += 1;
+                    times.push(bar.time);
+                }} else if (times[i] !== bar.time) {{
+                    continue;
+                }}
+                var prev = i > 0 ? candles[i - 1] : null;
+                var prevClose = prev ? (prev.value || prev)[1] : null;
+                candles[i] = {{value: [bar.open, bar.close, bar.low, bar.high, prevClose ? bar.close / prevClose - 1 : null]}};
+                volumes[i] = {{value: Math.round(bar.volume * 100) / 100}};
+                for (var m = 0; m < mas.length; m++) {{
+                    var sum = 0;
+                    for (var j = Math.max(i - mas[m] + 1, 0); j <= i; j++) {{ sum += (candles[j].value || candles[j])[1]; }}
+                    lines[m][i] = i + 1 >= mas[m] ? Math.round(sum / mas[m] * 100) / 100 : null;
+                }}
+            }}
+            chart.setOption({{
+                xAxis: [{{data: times}}, {{data: times}}],
+                series: [{{data: candles}}, {{data: volumes}}].concat(lines.map(function(d){{ return {{data: d}}; }}))
+            }});
+        }};
+    }}
+    """
+    chart = Echarts(options=options, extra_js=extra_js, width=width, height=height)
+    chart.render_hooks = [f"candlestick_stream_{uid}"]
+    return chart
+
+
+def _category_codes(values: pd.Series, axis_data: list = None):
+    """
+    类别列字典编码，只对去重后的类别做字符串转换和排序
+    结果按(列指纹,轴顺序)缓存，同一份数据重复画热力图时跳过编码，每次返回新的数组和list
+    :param values: 类别列
+    :param axis_data: 轴顺序 不提供直接按字符串排序
+    :return: (整数编码数组, 轴标签list) 不在轴上的值编码为-1
+    """
+    md5 = hashlib.md5(pd.util.hash_pandas_object(values, index=False).to_numpy().tobytes())
+    md5.update(str(values.dtype).encode("utf-8"))
+    key = (md5.hexdigest(), None if axis_data is None else tuple(str(v) for v in axis_data))
+    if key in _CATEGORY_CODES_CACHE:
+        _CATEGORY_CODES_CACHE.move_to_end(key)
+        codes, axis_labels = _CATEGORY_CODES_CACHE[key]
+        return codes.copy(), list(axis_labels)
+    codes, axis_labels = _encode_categories(values, axis_data)
+    _CATEGORY_CODES_CACHE[key] = (codes.copy(), list(axis_labels))
+    if len(_CATEGORY_CODES_CACHE) > CATEGORY_CODES_CACHE_SIZE:
+        _CATEGORY_CODES_CACHE.popitem(last=False)
+    return codes, axis_labels
+
+
+def _encode_categories(values: pd.Series, axis_data: list = None):
+    """
+    _category_codes 的实际编码，不经过缓存
+    """
+    codes, uniques = pd.factorize(values, sort=False)
+    labels = [str(v) for v in uniques]
+    if axis_data is None:
+        axis_labels = sorted(set(labels))
+    else:
+        axis_labels = [str(v) for v in axis_data]
+    position = {v: i for i, v in enumerate(axis_labels)}
+    # 最后补一个-1，factorize 对缺失值的编码-1 映射后仍然是-1
+    mapping = np.array([position.get(v, -1) for v in labels] + [-1], dtype=np.int64)
+    return mapping[codes], axis_labels
+
+
+def _bin_labels(edges: np.ndarray) -> list:
+    """
+    分箱左边界作为轴标签, 数值精度自动增加直到标签不重复
+    """
+    left = edges[:-1]
+    if np.issubdtype(left.dtype, np.datetime64):
+        times = pd.DatetimeIndex(left)
+        fmt = "%Y-%m-%d" if (times == times.normalize()).all() else "%Y-%m-%d %H:%M:%S"
+        return list(times.strftime(fmt))
+    for precision in range(4, 16):
+        labels = ['%.*g' % (precision, v) for v in left]
+        if len(set(labels)) == len(labels):
+            break
+    return labels
 
 
 def heatmap_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str = None, color_field: str = None,
@@ -818,32 +941,105 @@ def heatmap_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str
                     color_sequence: list = ["#313695", "#4575b4", "#74add1", "#abd9e9", "#e0f3f8", "#ffffbf", "#fee090",
                                             "#fdae61", "#f46d43", "#d73027", "#a50026"],
                     label_show=False, label_font_size=8,
+                    bins=None, bin_agg: str = 'count', bin_quantile: float = 0.5,
+                    x_scale: str = None, y_scale: str = None, x_range=None, y_range=None, value_range=None,
                     title: str = "",
                     width: str = "100%", height: str = "500px",**kwargs) -> Echarts:
     """
     二维热度图
+    x,y 轴做字典编码: 轴标签只输出一次，每个格子输出 [x序号,y序号,值] 整数下标三元组
+    指定bins时为分箱模式: 原始散点先在服务端分箱聚合成网格，再输出热度图，适合千万级别的点
 
     :param data_frame: 必填 DataFrame
     :param x_field: 必填 x轴映射的列
     :param y_field: 必填 y轴映射的列
     :param color_field: color映射列
-    :param label_field: label映射列 必须是数字类型
+    :param label_field: label映射列
     :param y_axis_data: x轴顺序 不提供直接按值排序
     :param x_axis_data: y轴顺序 不提供直接按值排序
     :param color_sequence: color色卡序列
     :param label_font_size: 8
     :param label_show: 是否显示label
+    :param bins: 分箱模式 分箱个数 int 或者 (x分箱个数,y分箱个数), 分箱模式data_frame可以是DataFrame迭代器
+    :param bin_agg: 分箱聚合方式 count/sum/mean/quantile, 聚合color_field列
+    :param bin_quantile: bin_agg=quantile 时的分位数
+    :param x_scale: 分箱刻度 linear/log/datetime 不提供时datetime类型列使用datetime,其他使用linear
+    :param y_scale: 分箱刻度 linear/log/datetime
+    :param x_range: 分箱范围 (最小值,最大值) 分块输入时必须提供
+    :param y_range: 分箱范围 (最小值,最大值) 分块输入时必须提供
+    :param value_range: 分块输入bin_agg=quantile时color_field的取值范围
     :param title: 可选标题
     :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
     :param height: 输出div的高度 支持像素和百分比 比如800px/100%
     :return:
     """
+    if bins is not None:
+        grid, x_edges, y_edges = Tools.bin2d(data_frame, x_field, y_field, value_field=color_field, bins=bins,
+                                             agg=bin_agg, q=bin_quantile, x_scale=x_scale, y_scale=y_scale,
+                                             x_range=x_range, y_range=y_range, value_range=value_range)
+        mask = np.isfinite(grid)
+        if bin_agg in ('count', 'sum'):
+            mask &= grid != 0
+        xi, yi = np.nonzero(mask)
+        values = grid[mask]
+        data = list(map(list, zip(xi.tolist(), yi.tolist(), values.tolist())))
+        return _heatmap_from_codes(data, _bin_labels(x_edges), _bin_labels(y_edges),
+                                   color_min=values.min() if len(values) > 0 else None,
+                                   color_max=values.max() if len(values) > 0 else None,
+                                   color_sequence=color_sequence, label_show=label_show,
+                                   label_font_size=label_font_size, title=title, width=width, height=height,
+                                   **kwargs)
     label_field = color_field if label_field is None else label_field
-    df = data_frame[[x_field, y_field]].copy()
-    df[x_field] = df[x_field].astype(str)
-    df[y_field] = df[y_field].astype(str)
-    df[label_field + '_label'] = data_frame[label_field]
-    df[color_field + '_color'] = data_frame[color_field]
+    x_codes, x_labels = _category_codes(data_frame[x_field], x_axis_data)
+    y_codes, y_labels = _category_codes(data_frame[y_field], y_axis_data)
+    mask = (x_codes >= 0) & (y_codes >= 0)
+    color_values = data_frame[color_field].to_numpy()[mask]
+    columns = [x_codes[mask].tolist(), y_codes[mask].tolist()]
+    label_table = None
+    if label_field != color_field:
+        # label可能是字符串，字典编码后标签表放进extra_js，格子里只放整数下标
+        label_codes, label_table = pd.factorize(data_frame[label_field].to_numpy()[mask])
+        columns.append(label_codes.tolist())
+        label_table = list(label_table)
+    columns.append(color_values.tolist())
+    return _heatmap_from_codes(list(map(list, zip(*columns))), x_labels, y_labels, label_table=label_table,
+                               color_min=np.nanmin(color_values) if len(color_values) > 0 else None,
+                               color_max=np.nanmax(color_values) if len(color_values) > 0 else None,
+                               color_sequence=color_sequence, label_show=label_show,
+                               label_font_size=label_font_size, title=title, width=width, height=height, **kwargs)
+
+
+def _heatmap_from_codes(data: list, x_labels: list, y_labels: list, color_min=None, color_max=None,
+                        color_sequence: list = None, label_show=False, label_font_size=8, title: str = "",
+                        width: str = "100%", height: str = "500px", label_table: list = None, **kwargs) -> Echarts:
+    """
+    已编码热度图数据输出Echarts，轴标签通过extra_js声明一次，坐标轴和tooltip共用
+    :param data: [[x序号,y序号,值],...] 或者 [[x序号,y序号,label,color],...], 也可以是生成这种数组的Js表达式
+    :param x_labels: x轴标签
+    :param y_labels: y轴标签
+    :param label_table: label标签表，提供时data第3列是标签表下标，浏览器端还原成标签
+    :return:
+    """
+    dimension = 2
+    var_suffix = uuid.uuid4().hex
+    x_var = "heatmap_x_" + var_suffix
+    y_var = "heatmap_y_" + var_suffix
+    extra_js = f"var {x_var} = {json.dumps(x_labels)};var {y_var} = {json.dumps(y_labels)};"
+    if not isinstance(data, Js):
+        dimension = len(data[0]) - 1 if len(data) > 0 else 2
+        data = Tools.compact_data(data)
+        if label_table is not None:
+            label_var = "heatmap_label_" + var_suffix
+            extra_js += f"var {label_var} = {json.dumps(label_table, ensure_ascii=False, default=json_type_convert)};"
+            data = Js("(function(l,d){for(var i=0;i<d.length;i++){d[i][2]=d[i][2]<0?null:l[d[i][2]];}return d;})"
+                      "(%s,%s)" % (label_var, data.js_code.replace(FUNCTION_BOUNDARY_MARK, "")))
+    x_axis = {
+        'type': 'category',
+        'data': Js(x_var),
+        'splitArea': {
+            'show': True
+        }
+    }
     options = {
         'animation': False,
         'title': {'text': title},
@@ -851,7 +1047,12 @@ def heatmap_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str
             'position': 'top',
             'color': "black",
             'backgroundColor': "rgba(255,255,255,0.8)",
-            'formatter': "{c}"
+            'formatter': Js(f"""
+                function(params){{
+                    var v = params.value;
+                    return {x_var}[v[0]] + ', ' + {y_var}[v[1]] + ': ' + v[2];
+                }}
+            """)
         },
         'grid': {'left': "2%", 'right': '3%'},
         'toolbox': {
@@ -861,34 +1062,22 @@ def heatmap_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str
                 'saveAsImage': {}
             }
         },
-        'xAxis': [{
-            'type': 'value',
-            'data': [str(v) for v in sorted(df[x_field].unique())] if x_axis_data is None else x_axis_data,
-            'splitArea': {
-                'show': True
-            }
-        }, {
-            'type': 'value',
-            'data': [str(v) for v in sorted(df[x_field].unique())] if x_axis_data is None else x_axis_data,
-            'splitArea': {
-                'show': True
-            }
-        }],
+        'xAxis': [x_axis, copy.deepcopy(x_axis)],
         'yAxis': {
-            'type': 'value',
-            'data': [str(v) for v in sorted(df[y_field].unique())] if y_axis_data is None else y_axis_data,
+            'type': 'category',
+            'data': Js(y_var),
             'splitArea': {
                 'show': True
             }
         },
         'visualMap': {
-            'min': df[color_field + '_color'].min(),
-            'max': df[color_field + '_color'].max(),
+            'min': color_min,
+            'max': color_max,
             'calculable': True,
             'orient': 'horizontal',
             'left': 'center',
             'bottom': '0',
-            'dimension': 3,
+            'dimension': dimension,
             'inRange': {
                 'color': color_sequence
             }
@@ -897,21 +1086,91 @@ def heatmap_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str
         'series': [{
             'name': title,
             'type': 'heatmap',
-            'data': df.values.tolist(),
+            'data': data,
             'label': {
                 'show': label_show,
                 'fontSize': label_font_size
             }
         }]
     }
-    if "date" in str(df[x_field].dtype) or "object" in str(df[x_field].dtype):
-        options['xAxis'][0]['type'] = 'category'
-        options['xAxis'][1]['type'] = 'category'
-    if "date" in str(df[y_field].dtype) or "object" in str(df[y_field].dtype):
-        options['yAxis']['type'] = 'category'
-
     options.update(kwargs)
-    return Echarts(options=options, width=width, height=height)
+    return Echarts(options=options, extra_js=extra_js, width=width, height=height)
+
+
+def corr_heatmap_echarts(data_frame: pd.DataFrame, cluster: bool = False, upper_triangle: bool = False,
+                         block_size: int = 1024, precision: int = 3,
+                         color_sequence: list = ["#313695", "#4575b4", "#74add1", "#abd9e9", "#e0f3f8", "#ffffbf",
+                                                 "#fee090", "#fdae61", "#f46d43", "#d73027", "#a50026"],
+                         title: str = "",
+                         width: str = "100%", height: str = "800px", **kwargs) -> Echarts:
+    """
+    相关系数矩阵热度图，适合上千个资产的收益率序列
+    分块矩阵乘法计算成对完整样本的相关系数(和DataFrame.corr()一致，缺失值不填充)，格子只输出相关系数数组，浏览器端还原成坐标
+
+    :param data_frame: 宽表 每列一个资产的收益率序列
+    :param cluster: 是否按层次聚类重新排列资产顺序，需要安装scipy
+    :param upper_triangle: 是否只显示上三角，数据量减半
+    :param block_size: 分块计算的列数
+    :param precision: 相关系数保留小数位数
+    :param color_sequence: color色卡序列
+    :param title: 可选标题
+    :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
+    :param height: 输出div的高度 支持像素和百分比 比如800px/100%
+    :return:
+    """
+    values = data_frame.to_numpy(dtype=np.float64)
+    n = data_frame.shape[1]
+    observed = ~np.isnan(values)
+    # 先减去列均值，减小平方和相减时的精度损失
+    with np.errstate(invalid='ignore'):
+        values = values - np.nanmean(values, axis=0)
+    x = np.where(observed, values, 0.0)
+    x2 = x * x
+    mask = observed.astype(np.float64)
+    corr = np.empty((n, n), dtype=np.float32)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        # 成对完整样本: 每对(i,j)只用两列都有值的行，和 DataFrame.corr() 一致
+        count = mask[:, start:end].T @ mask[:, start:]
+        sum_i = x[:, start:end].T @ mask[:, start:]
+        sum_j = mask[:, start:end].T @ x[:, start:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = x[:, start:end].T @ x[:, start:] - sum_i * sum_j / count
+            var_i = x2[:, start:end].T @ mask[:, start:] - sum_i * sum_i / count
+            var_j = mask[:, start:end].T @ x2[:, start:] - sum_j * sum_j / count
+            block = cov / np.sqrt(var_i * var_j)
+        block[(count < 2) | ~(var_i > 0) | ~(var_j > 0)] = np.nan
+        corr[start:end, start:] = block
+        corr[start:, start:end] = block.T
+    diagonal = np.diag(corr).copy()
+    np.fill_diagonal(corr, np.where(np.isnan(diagonal), np.nan, 1.0))
+    np.clip(corr, -1, 1, out=corr)
+    names = [str(c) for c in data_frame.columns]
+    if cluster:
+        try:
+            from scipy.cluster.hierarchy import linkage, leaves_list
+            from scipy.spatial.distance import squareform
+        except ImportError:
+            raise ImportError("cluster=True 需要安装 scipy")
+        dist = 1 - np.nan_to_num(corr.astype(np.float64), nan=0.0)
+        np.fill_diagonal(dist, 0)
+        order = leaves_list(linkage(squareform(np.clip(dist, 0, 2), checks=False), method='average'))
+        corr = corr[np.ix_(order, order)]
+        names = [names[i] for i in order]
+    cells = corr[np.triu_indices(n)] if upper_triangle else corr.ravel()
+    cells = np.round(cells.astype(np.float64), precision)
+    # 按行展开的相关系数数组在浏览器端还原成 [列序号,行序号,值]
+    data = Js(f"""(function(n, upper, v){{
+        var d = new Array(v.length), p = 0;
+        for (var i = 0; i < n; i++) {{
+            for (var j = upper ? i : 0; j < n; j++) {{ d[p] = [j, i, v[p]]; p++; }}
+        }}
+        return d;
+    }})({n}, {'true' if upper_triangle else 'false'}, {json.dumps(cells.tolist(), separators=(',', ':'))})""")
+    chart = _heatmap_from_codes(data, names, names, color_min=-1, color_max=1, color_sequence=color_sequence,
+                                title=title, width=width, height=height, **kwargs)
+    chart.options['yAxis']['inverse'] = True
+    return chart
 
 
 def radar_echarts(data_frame: pd.DataFrame, name_field: str = None, indicator_field_list: list = None,
@@ -989,24 +1248,101 @@ def radar_echarts(data_frame: pd.DataFrame, name_field: str = None, indicator_fi
 
 
 def calendar_heatmap_echarts(data_frame: pd.DataFrame, date_field: str = None, value_field: str = None,
+                             group_field: str = None, period: str = None, agg: str = 'sum',
                              title: str = "",
-                             width: str = "100%", height: str = "300px",**kwargs) -> Echarts:
+                             width: str = "100%", height: str = None,**kwargs) -> Echarts:
     """
     日历热度图，显示日期热度
+    日内数据先按天聚合，日期编码成相对首日的天数偏移，所有日历共用一份数据
     :param data_frame:
     :param date_field: 日期列
     :param value_field: 值列
+    :param group_field: 分组列，每组一行日历
+    :param period: 按pandas周期拆分成多个日历，每个周期一列，比如 Y/Q/M，None时一个日历覆盖全部日期
+    :param agg: 按天聚合方式 sum/mean/last/max/min 等
     :param title: 可选标题
     :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
-    :param height: 输出div的高度 支持像素和百分比 比如800px/100%
+    :param height: 输出div的高度 支持像素和百分比 比如800px/100%，不提供时单个日历300px，多个日历每行120px
     :return:
     """
-    df = data_frame[[date_field, value_field]].copy()
-    value_max = df[value_field].max()
-    value_min = df[value_field].min()
-    date_start = pd.to_datetime(df[date_field].min()).strftime("%Y-%m-%d")
-    date_end = pd.to_datetime(df[date_field].max()).strftime("%Y-%m-%d")
-    df[date_field] = pd.to_datetime(df[date_field]).dt.strftime("%Y-%m-%d")
+    dates = pd.to_datetime(data_frame[date_field]).dt.normalize()
+    keys = [dates.rename('date')] if group_field is None else [data_frame[group_field], dates.rename('date')]
+    daily = data_frame[value_field].groupby(keys, sort=True).agg(agg).dropna().reset_index()
+    first_day = daily['date'].min()
+    offsets = ((daily['date'] - first_day) // pd.Timedelta(days=1)).to_numpy()
+    if period is not None:
+        periods = daily['date'].dt.to_period(period)
+        period_codes, period_list = pd.factorize(periods, sort=True)
+        ranges = [[p.start_time.strftime("%Y-%m-%d"), p.end_time.strftime("%Y-%m-%d")] for p in period_list]
+    else:
+        period_codes = np.zeros(len(daily), dtype=np.int64)
+        ranges = [[first_day.strftime("%Y-%m-%d"), daily['date'].max().strftime("%Y-%m-%d")]]
+    if group_field is not None:
+        group_codes, groups = pd.factorize(daily[group_field])
+        groups = list(groups)
+    else:
+        group_codes, groups = np.zeros(len(daily), dtype=np.int64), [title]
+    calendar_codes = group_codes * len(ranges) + period_codes
+    uid = uuid.uuid4().hex
+    data_var = f"calendar_data_{uid}"
+    extra_js = f"""
+    var {data_var} = (function(base, cal, off, val, n){{
+        var out = [];
+        for (var i = 0; i < n; i++) {{ out.push([]); }}
+        for (var i = 0; i < off.length; i++) {{
+            out[cal[i]].push([new Date(base[0], base[1], base[2] + off[i]).getTime(), val[i]]);
+        }}
+        return out;
+    }})({json.dumps([first_day.year, first_day.month - 1, first_day.day])},
+        {json.dumps(calendar_codes.tolist(), separators=(',', ':'))},
+        {json.dumps(offsets.tolist(), separators=(',', ':'))},
+        {json.dumps(daily[value_field].tolist(), separators=(',', ':'))}, {len(groups) * len(ranges)});
+    """
+    base_calendar = {
+        'cellSize': ['auto', 'auto'],
+        'itemStyle': {
+            'borderWidth': 0.5
+        },
+        'dayLabel': {
+            'firstDay': 1
+        },
+        'monthLabel': {
+            'nameMap': 'cn'
+        },
+        'yearLabel': {'show': True}
+    }
+    calendars = []
+    series = []
+    column_width = 100 / len(ranges)
+    for group_index, group in enumerate(groups):
+        for range_index, date_range in enumerate(ranges):
+            calendar = copy.deepcopy(base_calendar)
+            calendar['range'] = date_range
+            if len(groups) == 1 and len(ranges) == 1:
+                calendar.update({'top': 60, 'left': 30, 'right': 30})
+            else:
+                calendar.update({'top': 80 + 120 * group_index, 'height': 80,
+                                 'left': f"{column_width * range_index + 1}%", 'width': f"{column_width - 2}%"})
+                calendar['yearLabel'] = {'show': True, 'position': 'top', 'margin': 2, 'fontSize': 10,
+                                         'formatter': "{start}" if group_field is None else f"{group} {{start}}"}
+                calendar['dayLabel']['show'] = False
+                calendar['monthLabel']['fontSize'] = 8
+            calendars.append(calendar)
+            series.append({
+                'type': 'heatmap',
+                'name': str(group),
+                'coordinateSystem': 'calendar',
+                'calendarIndex': len(calendars) - 1,
+                'emphasis': {
+                    'itemStyle': {
+                        'borderColor': "#333",
+                        'borderWidth': 1,
+                        'shadowColor': 'rgba(0, 0, 0, 0.5)',
+                        'shadowBlur': 15
+                    }
+                },
+                'data': Js(f"{data_var}[{len(calendars) - 1}]")
+            })
     options = {
         'animation': False,
         'title': {
@@ -1015,7 +1351,13 @@ def calendar_heatmap_echarts(data_frame: pd.DataFrame, date_field: str = None, v
         'tooltip': {
             'color': "black",
             'backgroundColor': "rgba(255,255,255,0.8)",
-            'formatter': "{c}"
+            'formatter': Js("""
+                function(params){
+                    var d = new Date(params.value[0]);
+                    var date = d.getFullYear() + '-' + (d.getMonth() + 1) + '-' + d.getDate();
+                    return (params.seriesName ? params.seriesName + '<br/>' : '') + date + ': ' + params.value[1];
+                }
+            """)
         },
         'toolbox': {
             'show': True,
@@ -1026,8 +1368,8 @@ def calendar_heatmap_echarts(data_frame: pd.DataFrame, date_field: str = None, v
         },
         'visualMap': {
             'text': ['高', '低'],
-            'min': value_min,
-            'max': value_max,
+            'min': daily[value_field].min(),
+            'max': daily[value_field].max(),
             'type': 'continuous',
             'orient': 'horizontal',
             'inRange': {
@@ -1038,56 +1380,39 @@ def calendar_heatmap_echarts(data_frame: pd.DataFrame, date_field: str = None, v
             'top': 0,
             'hoverLink': True
         },
-        'calendar': {
-            'top': 60,
-            'left': 30,
-            'right': 30,
-            'cellSize': ['auto', 'auto'],
-            'range': [date_start, date_end],
-            'itemStyle': {
-                'borderWidth': 0.5
-            },
-            'dayLabel': {
-                'firstDay': 1
-            },
-            'monthLabel': {
-                'nameMap': 'cn'
-            },
-            'yearLabel': {'show': True}
-        },
-        'series': {
-            'type': 'heatmap',
-            'coordinateSystem': 'calendar',
-            'emphasis': {
-                'itemStyle': {
-                    'borderColor': "#333",
-                    'borderWidth': 1,
-                    'shadowColor': 'rgba(0, 0, 0, 0.5)',
-                    'shadowBlur': 15
-                }
-            },
-            'data': df[[date_field, value_field]].values.tolist()
-        }
+        'calendar': calendars[0] if len(calendars) == 1 else calendars,
+        'series': series[0] if len(series) == 1 else series
     }
     options.update(kwargs)
-    return Echarts(options=options, width=width, height=height)
+    if height is None:
+        height = "300px" if len(calendars) == 1 else f"{80 + 120 * len(groups)}px"
+    return Echarts(options=options, extra_js=extra_js, width=width, height=height)
 
 
 def parallel_echarts(data_frame: pd.DataFrame, name_field: str = None, indicator_field_list: list = [],
+                     single_series: bool = False, max_rows: int = None, stratify_field: str = None,
                      title: str = "",
                      width: str = "100%", height: str = "500px",**kwargs) -> Echarts:
     """
     平行坐标图,要求name列每行唯一 比如：显示每个报告期各财务指标
+    行数很多时使用 single_series=True: 所有行放在一个渐进渲染的series里，name单独保存，tooltip按下标查找
     :param data_frame:
     :param name_field: name列
     :param indicator_field_list: 数据维度列list
+    :param single_series: 是否所有行合并成一个series
+    :param max_rows: 行数超过max_rows时分层抽样到max_rows行，坐标轴范围仍按全量数据计算
+    :param stratify_field: 分层抽样的分层列，不提供时按第一个数值维度的十分位分层
     :param title: 可选标题
     :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
     :param height: 输出div的高度 支持像素和百分比 比如800px/100%
     :return:
     """
-    df = data_frame[list(set([name_field] + indicator_field_list))].copy()
+    columns = list(dict.fromkeys([name_field] + indicator_field_list +
+                                 ([stratify_field] if stratify_field is not None else [])))
+    df = data_frame[columns]
     dims = str(indicator_field_list)
+    names_var = "parallel_names_" + uuid.uuid4().hex
+    series_name_js = names_var + "[params.dataIndex]" if single_series else "params.seriesName"
     options = {
         'title': {'text': title},
         'legend': {
@@ -1110,7 +1435,7 @@ def parallel_echarts(data_frame: pd.DataFrame, name_field: str = None, indicator
             'formatter': Js(f""" function(params){{
                     var dims={dims};
                     var value_dict={{}};
-                    var labels=[params.seriesName+':<br/>'];
+                    var labels=[{series_name_js}+':<br/>'];
                     for(var i=0;i<dims.length;i++){{
                         labels.push('<span>'+dims[i]+":"+params['value'][i]+'</span><br/>');
                     }}
@@ -1126,52 +1451,79 @@ def parallel_echarts(data_frame: pd.DataFrame, name_field: str = None, indicator
         'parallelAxis': [],
         'series': []
     }
-    value_dict_list = df.to_dict(orient='records')
+    numeric_fields = [col for col in indicator_field_list if
+                      'int' in str(df[col].dtype) or 'float' in str(df[col].dtype)]
+    data_min = df[numeric_fields].min()
+    data_max = df[numeric_fields].max()
     for i in range(0, len(indicator_field_list)):
-        data_min = df[indicator_field_list[i]].min()
-        data_max = df[indicator_field_list[i]].max()
-        if 'int' in str(df[indicator_field_list[i]].dtype) or 'float' in str(df[indicator_field_list[i]].dtype):
+        field = indicator_field_list[i]
+        if field in numeric_fields:
             col = {
                 'dim': i,
-                'name': indicator_field_list[i],
+                'name': field,
                 'type': 'value',
-                'min': round(data_min - (data_max - data_min) * 0.1, 2),
-                'max': round(data_max + (data_max - data_min) * 0.1, 2)
+                'min': round(data_min[field] - (data_max[field] - data_min[field]) * 0.1, 2),
+                'max': round(data_max[field] + (data_max[field] - data_min[field]) * 0.1, 2)
             }
         else:
-            col = {'dim': i, 'name': indicator_field_list[i], 'type': 'category',
-                   'data': sorted(df[indicator_field_list[i]].unique())}
+            col = {'dim': i, 'name': field, 'type': 'category',
+                   'data': sorted(df[field].unique())}
 
         options['parallelAxis'].append(col)
-    for value_dict in value_dict_list:
-        series = {
-            'name': value_dict[name_field],
-            'type': 'parallel',
-            'lineStyle': {'width': 2},
-            'emphasis': {
-                'lineStyle': {
-                    'width': 5,
-                    'borderColor': "black",
-                    'borderWidth': 2,
-                    'shadowColor': 'rgba(0, 0, 0, 1)',
-                    'shadowBlur': 15
-                }
-            },
-            'data': [[value_dict[col] for col in indicator_field_list]]
+    if max_rows is not None and df.shape[0] > max_rows:
+        if stratify_field is not None:
+            strata = df[stratify_field]
+        elif len(numeric_fields) > 0:
+            strata = pd.qcut(df[numeric_fields[0]].rank(method='first'), q=min(10, max_rows), labels=False)
+        else:
+            strata = pd.Series(0, index=df.index)
+        df = df.groupby(strata.to_numpy(), group_keys=False).sample(frac=max_rows / df.shape[0], random_state=0)
+    emphasis = {
+        'lineStyle': {
+            'width': 5,
+            'borderColor': "black",
+            'borderWidth': 2,
+            'shadowColor': 'rgba(0, 0, 0, 1)',
+            'shadowBlur': 15
         }
-
-        options['series'].append(series)
-        options['legend']['data'].append(value_dict[name_field])
+    }
+    extra_js = ""
+    if single_series:
+        extra_js = f"var {names_var} = {json.dumps(df[name_field].tolist(), default=json_type_convert)};"
+        options['series'].append({
+            'name': title,
+            'type': 'parallel',
+            'progressive': 500,
+            'progressiveThreshold': 3000,
+            'lineStyle': {'width': 1, 'opacity': 0.5},
+            'emphasis': emphasis,
+            'data': df[indicator_field_list].values.tolist()
+        })
+        options['legend']['data'].append(title)
+    else:
+        names = df[name_field].tolist()
+        rows = df[indicator_field_list].values.tolist()
+        for i in range(0, len(rows)):
+            series = {
+                'name': names[i],
+                'type': 'parallel',
+                'lineStyle': {'width': 2},
+                'emphasis': emphasis,
+                'data': [rows[i]]
+            }
+            options['series'].append(series)
+            options['legend']['data'].append(names[i])
     options.update(kwargs)
-    return Echarts(options=options, width=width, height=height)
+    return Echarts(options=options, extra_js=extra_js, width=width, height=height)
 
 
 def sankey_echarts(data_frame: pd.DataFrame, source_field: str = None, target_field: str = None,
                    value_field: str = None, source_depth_field: str = None, target_depth_field: str = None,
+                   min_value: float = None, top_k: int = None,
                    title: str = "",
                    width: str = "100%", height: str = "500px",**kwargs) -> Echarts:
     """
-
+    桑基图，相同(source,target)的value求和合并，links按节点下标输出
 
     :param data_frame:
     :param source_field: source列
@@ -1179,13 +1531,37 @@ def sankey_echarts(data_frame: pd.DataFrame, source_field: str = None, target_fi
     :param value_field: value列
     :param source_depth_field:
     :param target_depth_field:
+    :param min_value: 合并后value小于min_value的link丢弃
+    :param top_k: 每个节点的出边和入边都只保留value最大的top_k条link，同时排在source出边和target入边前top_k的link才保留
     :param title: 可选标题
     :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
     :param height: 输出div的高度 支持像素和百分比 比如800px/100%
     :return:
     """
-    names = list(
-        set(data_frame[source_field].dropna().unique()).union(set(data_frame[target_field].dropna().unique())))
+    row_count = data_frame.shape[0]
+    codes, names = pd.factorize(pd.concat([data_frame[source_field], data_frame[target_field]], ignore_index=True))
+    source, target = codes[:row_count], codes[row_count:]
+    values = data_frame[value_field].to_numpy(dtype=float)
+    valid = (source >= 0) & (target >= 0) & ~np.isnan(values)
+    # 相同(source,target)合并
+    keys, inverse = np.unique(source[valid].astype(np.int64) * len(names) + target[valid], return_inverse=True)
+    link_value = np.bincount(inverse, weights=values[valid], minlength=len(keys))
+    source, target = keys // len(names), keys % len(names)
+    keep = np.ones(len(keys), dtype=bool)
+    if min_value is not None:
+        keep &= link_value >= min_value
+    if top_k is not None:
+        # 出边按source分组、入边按target分组，组内按value降序排名，两边都在前top_k才保留
+        for side in (source, target):
+            order = np.lexsort((-link_value, side))
+            starts = np.searchsorted(side[order], side[order], side='left')
+            keep[order[np.arange(len(order)) - starts >= top_k]] = False
+    source, target, link_value = source[keep], target[keep], link_value[keep]
+    # 只保留还有link的节点，重新编号
+    used = np.unique(np.concatenate([source, target]))
+    node_index = np.full(len(names), -1, dtype=np.int64)
+    node_index[used] = np.arange(len(used))
+    names = names[used]
     depth_dict = {}
     if source_depth_field is not None:
         depth_dict.update(
@@ -1197,8 +1573,11 @@ def sankey_echarts(data_frame: pd.DataFrame, source_field: str = None, target_fi
             data_frame[[target_field, target_depth_field]].drop_duplicates(subset=[target_field]).dropna(
                 subset=[target_field]).set_index(
                 target_field)[target_depth_field].to_dict())
-
-    df = data_frame.rename(columns={source_field: "source", target_field: 'target', value_field: 'value'})
+    links = Js("(function(s,t,v){var r=new Array(s.length);for(var i=0;i<s.length;i++){"
+               "r[i]={source:s[i],target:t[i],value:v[i]};}return r;})(%s,%s,%s)" % (
+                   json.dumps(node_index[source].tolist(), separators=(',', ':')),
+                   json.dumps(node_index[target].tolist(), separators=(',', ':')),
+                   json.dumps(link_value.tolist(), separators=(',', ':'))))
     options = {
         'title': {
             'text': title,
@@ -1219,7 +1598,7 @@ def sankey_echarts(data_frame: pd.DataFrame, source_field: str = None, target_fi
             'type': 'sankey',
             'data': [{'name': name} for name in names] if len(depth_dict) == 0 else [
                 {'name': name, 'depth': depth_dict[name] if name in depth_dict else 0} for name in names],
-            'links': df[['source', 'target', 'value']].dropna().to_dict(orient='records'),
+            'links': links,
             'lineStyle': {
                 'color': 'source',
                 'curveness': 0.5
@@ -1244,6 +1623,84 @@ def sankey_echarts(data_frame: pd.DataFrame, source_field: str = None, target_fi
     return Echarts(options=options, width=width, height=height)
 
 
+def network_echarts(data_frame: pd.DataFrame, source_field: str = None, target_field: str = None,
+                    value_field: str = None, iterations: int = 100, title: str = "",
+                    width: str = "100%", height: str = "800px", **kwargs) -> Echarts:
+    """
+    网络关系图，节点坐标在python端用力导向算法计算(Tools.force_layout，按图缓存)，页面不再运行force布局，支持几万到十几万节点
+    相同(source,target)的value求和合并，自环丢弃，节点大小按度数
+
+    :param data_frame:
+    :param source_field: source列
+    :param target_field: target列
+    :param value_field: 边权重列，可选，权重越大两端节点越靠近
+    :param iterations: 布局迭代轮数
+    :param title: 可选标题
+    :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
+    :param height: 输出div的高度 支持像素和百分比 比如800px/100%
+    :return:
+    """
+    row_count = data_frame.shape[0]
+    codes, names = pd.factorize(pd.concat([data_frame[source_field], data_frame[target_field]], ignore_index=True))
+    source, target = codes[:row_count].astype(np.int64), codes[row_count:].astype(np.int64)
+    values = np.ones(row_count) if value_field is None else data_frame[value_field].to_numpy(dtype=float)
+    valid = (source >= 0) & (target >= 0) & (source != target) & ~np.isnan(values)
+    keys, inverse = np.unique(source[valid] * len(names) + target[valid], return_inverse=True)
+    link_value = np.bincount(inverse, weights=values[valid], minlength=len(keys))
+    source, target = keys // len(names), keys % len(names)
+    positions = Tools.force_layout(source, target, len(names), weights=link_value, iterations=iterations)
+    degree = np.bincount(source, minlength=len(names)) + np.bincount(target, minlength=len(names))
+    sizes = np.round(3 + 12 * np.sqrt(degree / max(degree.max(), 1)), 1)
+    names_var = f"network_names_{uuid.uuid4().hex}"
+    extra_js = f"var {names_var} = {json.dumps(list(names), ensure_ascii=False, default=json_type_convert)};"
+    nodes = Js("(function(n,x,y,d,z){var r=new Array(n.length);for(var i=0;i<n.length;i++){"
+               "r[i]={name:n[i],x:x[i],y:y[i],value:d[i],symbolSize:z[i]};}return r;})(%s,%s,%s,%s,%s)" % (
+                   names_var,
+                   json.dumps(np.round(positions[:, 0], 1).tolist(), separators=(',', ':')),
+                   json.dumps(np.round(positions[:, 1], 1).tolist(), separators=(',', ':')),
+                   json.dumps(degree.tolist(), separators=(',', ':')),
+                   json.dumps(sizes.tolist(), separators=(',', ':'))))
+    links = Js("(function(s,t,v){var r=new Array(s.length);for(var i=0;i<s.length;i++){"
+               "r[i]={source:s[i],target:t[i],value:v[i]};}return r;})(%s,%s,%s)" % (
+                   json.dumps(source.tolist(), separators=(',', ':')),
+                   json.dumps(target.tolist(), separators=(',', ':')),
+                   json.dumps(link_value.tolist(), separators=(',', ':'))))
+    options = {
+        'animation': False,
+        'title': {
+            'text': title,
+            'left': 'center'
+        },
+        'tooltip': {
+            'color': "black",
+            'backgroundColor': "rgba(255,255,255,0.8)"
+        },
+        'toolbox': {
+            'show': True,
+            'feature': {
+                'restore': {},
+                'saveAsImage': {}
+            }
+        },
+        'series': [{
+            'type': 'graph',
+            'layout': 'none',
+            'roam': True,
+            'data': nodes,
+            'links': links,
+            'label': {'show': False},
+            'lineStyle': {
+                'color': 'source',
+                'width': 0.5,
+                'opacity': 0.3
+            },
+            'itemStyle': {'opacity': 0.8}
+        }]
+    }
+    options.update(kwargs)
+    return Echarts(options=options, extra_js=extra_js, width=width, height=height)
+
+
 def theme_river_echarts(data_frame: pd.DataFrame, date_field: str = None, value_field: str = None,
                         theme_field: str = None,
                         title: str = "",
@@ -1312,9 +1769,57 @@ def theme_river_echarts(data_frame: pd.DataFrame, date_field: str = None, value_
 
 def sunburst_echarts(data_frame: pd.DataFrame, category_field_list: list = [], value_field: str = None,
                      title: str = "",
-                     font_size: int = 8, node_click=False,
+                     font_size: int = 8, node_click=False, lazy_depth: int = None,
                      width: str = "100%", height: str = "500px",**kwargs) -> Echarts:
+    """
+    旭日图
+    :param data_frame: cat1,cat2,...,catN,value
+    :param category_field_list: 类别列表
+    :param value_field: 值列
+    :param title: 标题
+    :param font_size: 标签字体大小
+    :param node_click: 点击节点行为, False 或 'rootToNode'
+    :param lazy_depth: 首屏只嵌入前几层，更深的节点点击时再解析展开，节点很多时使用
+    :param width: 宽度
+    :param height: 高度
+    :return:
+    """
     data = Tools.df2tree(data_frame, category_field_list, value_field)
+    extra_js = ""
+    render_hooks = []
+    if lazy_depth is not None:
+        data, chunks = Tools.lazy_tree(data, lazy_depth)
+        uid = uuid.uuid4().hex
+        data_var = f"sunburst_data_{uid}"
+        extra_js = f"""
+        var {data_var} = {json.dumps(data, ensure_ascii=False, default=json_type_convert)};
+        var sunburst_chunks_{uid} = {json.dumps(chunks, ensure_ascii=False)};
+        function sunburst_lazy_{uid}(chart){{
+            chart.on('click', function(params){{
+                var key = params.data && params.data.lazy;
+                if (!key || !(key in sunburst_chunks_{uid})) {{ return; }}
+                var names = JSON.parse(key);
+                var nodes = {data_var};
+                var node = null;
+                for (var i = 0; i < names.length; i++) {{
+                    for (var j = 0; j < nodes.length; j++) {{
+                        if (nodes[j].name === names[i]) {{ node = nodes[j]; break; }}
+                    }}
+                    nodes = node.children || [];
+                }}
+                node.id = key;
+                node.children = JSON.parse(sunburst_chunks_{uid}[key]);
+                delete sunburst_chunks_{uid}[key];
+                delete node.lazy;
+                chart.setOption({{series: [{{data: {data_var}}}]}});
+                if ({json.dumps(node_click == 'rootToNode')}) {{
+                    chart.dispatchAction({{type: 'sunburstRootToNode', targetNode: key}});
+                }}
+            }});
+        }}
+        """
+        render_hooks.append(f"sunburst_lazy_{uid}")
+        data = Js(data_var)
     options = {
         'title': {
             'text': title,
@@ -1360,7 +1865,105 @@ def sunburst_echarts(data_frame: pd.DataFrame, category_field_list: list = [], v
         }
     }
     options.update(kwargs)
-    return Echarts(options, height=height, width=width)
+    chart = Echarts(options, extra_js=extra_js, height=height, width=width)
+    chart.render_hooks = render_hooks
+    return chart
+
+
+def _mark_columns(data_frame: pd.DataFrame, columns: list) -> list:
+    """
+    标注用到的列逐列转成list，日期列去重后格式化成字符串
+    """
+    result = []
+    for column in columns:
+        series = data_frame[column]
+        if series.dtype.kind == 'M':
+            # 只格式化去重后的日期
+            codes, uniques = pd.factorize(series)
+            labels = _datetime_strings(pd.Series(uniques)).tolist() + [None]
+            result.append(np.array(labels, dtype=object)[codes].tolist())
+        else:
+            result.append(series.tolist())
+    return result
+
+
+def _merge_mark(series: dict, key: str, mark: dict):
+    """
+    标注合并进已有series的markPoint/markLine/markArea，已有同类标注时组级样式下放到每条数据上再追加
+    """
+    if series.get(key) is None:
+        series[key] = mark
+        return
+    style = {k: v for k, v in mark.items() if k != 'data'}
+    # markLine组级symbol是[起点,终点]，数据项上每个端点各自设置
+    symbols = style.pop('symbol', None)
+    if not isinstance(symbols, list):
+        symbols = [symbols, symbols]
+    symbols = ['none' if symbol is None else symbol for symbol in symbols]
+    data = series[key].setdefault('data', [])
+    for item in mark['data']:
+        if isinstance(item, list):
+            first = {**style, **item[0]}
+            if 'symbol' in mark:
+                first.setdefault('symbol', symbols[0])
+                data.append([first, {'symbol': symbols[-1], **item[1]}] + item[2:])
+            else:
+                data.append([first] + item[1:])
+        else:
+            item = {**style, **item}
+            if 'symbol' in mark and symbols[0] == symbols[-1]:
+                item.setdefault('symbol', symbols[0])
+            data.append(item)
+
+
+def _target_series(series: list, target):
+    """
+    按下标或名称找标注目标series，找不到返回None
+    """
+    if isinstance(target, int) and -len(series) <= target < len(series):
+        return series[target]
+    for item in series:
+        if target is not None and item.get('name') == target:
+            return item
+    return None
+
+
+def mark_layer_echarts(chart: Echarts, annotations: list, target=0) -> Echarts:
+    """
+    多组标注一次性叠加到已有图表上，直接修改chart.options，不复制图表
+    标注的markPoint/markLine/markArea合并进目标series，坐标系和显示隐藏跟随目标series；
+    找不到目标series时才生成叠加series，legend可以单独控制显示隐藏
+    :param chart: 已有图表
+    :param annotations: [(类型, 参数dict), ...] 或 [(类型, 参数dict, 目标series), ...]
+                        类型 area/background/segment/label/vertical_line/horizontal_line, 参数同对应的 mark_*_echarts 函数,
+                        例如 [('label', {'data_frame': trades, 'x': 'date', 'y': 'price', 'label': 'side', 'title': '成交'})]
+    :param target: 默认目标series，下标或者series名称
+    :return: chart
+    """
+    builders = {'area': mark_area_echarts, 'background': mark_background_echarts, 'segment': mark_segment_echarts,
+                'label': mark_label_echarts, 'vertical_line': mark_vertical_line_echarts,
+                'horizontal_line': mark_horizontal_line_echarts}
+    options = chart.options
+    if options.get('series') is None:
+        options['series'] = []
+    elif isinstance(options['series'], dict):
+        options['series'] = [options['series']]
+    legend = options.get('legend')
+    for annotation in annotations:
+        kind, params = annotation[0], annotation[1]
+        if kind not in builders:
+            raise ValueError("不支持的标注类型 %s" % kind)
+        overlay = builders[kind](**params).options
+        series = _target_series(options['series'], annotation[2] if len(annotation) > 2 else target)
+        if series is None:
+            options['series'].extend(overlay['series'])
+            if isinstance(legend, dict) and legend.get('data') is not None:
+                legend['data'].extend(overlay['legend']['data'])
+            continue
+        for key in ('markPoint', 'markLine', 'markArea'):
+            if overlay['series'][0].get(key) is not None:
+                _merge_mark(series, key, overlay['series'][0][key])
+    return chart
 
 
 def mark_area_echarts(data_frame: pd.DataFrame, x1: str, y1: str, x2: str, y2: str, label: str, title: str = 'area',
@@ -1386,9 +1989,8 @@ def mark_area_echarts(data_frame: pd.DataFrame, x1: str, y1: str, x2: str, y2: s
     :return:
     """
     options = copy.deepcopy(ECHARTS_BASE_OVERLAY_OPTIONS)
-    rows = data_frame[[x1, y1, x2, y2, label]].to_dict(orient='records')
-    data = [[{'name': row[label], 'coord': [row[x1], row[y1]]},
-             {'coord': [row[x2], row[y2]]}] for row in rows]
+    data = [[{'name': name, 'coord': [a, b]}, {'coord': [c, d]}]
+            for name, a, b, c, d in zip(*_mark_columns(data_frame, [label, x1, y1, x2, y2]))]
     base_mark_area_options = {
         'itemStyle': {
             'opacity': fill_opacity
@@ -1434,9 +2036,8 @@ def mark_background_echarts(data_frame: pd.DataFrame, x1: str, x2: str, label: s
     :return:
     """
     options = copy.deepcopy(ECHARTS_BASE_OVERLAY_OPTIONS)
-    rows = data_frame[[x1, x2, label]].to_dict(orient='records')
-    data = [[{'name': row[label], 'xAxis': row[x1]},
-             {'xAxis': row[x2]}] for row in rows]
+    data = [[{'name': name, 'xAxis': a}, {'xAxis': b}]
+            for name, a, b in zip(*_mark_columns(data_frame, [label, x1, x2]))]
     base_mark_area_options = {
         'itemStyle': {
             'opacity': fill_opacity,
@@ -1492,13 +2093,11 @@ def mark_segment_echarts(data_frame: pd.DataFrame, x1: str, y1: str, x2: str, y2
     """
     options = copy.deepcopy(ECHARTS_BASE_OVERLAY_OPTIONS)
     if show_label:
-        rows = data_frame[[x1, y1, x2, y2, label]].to_dict(orient='records')
-        data = [[{'name': str(row[label]), 'coord': [row[x1], row[y1]]},
-                 {'coord': [row[x2], row[y2]]}] for row in rows]
+        data = [[{'name': str(name), 'coord': [a, b]}, {'coord': [c, d]}]
+                for name, a, b, c, d in zip(*_mark_columns(data_frame, [label, x1, y1, x2, y2]))]
     else:
-        rows = data_frame[[x1, y1, x2, y2]].to_dict(orient='records')
-        data = [[{'coord': [row[x1], row[y1]]},
-                 {'coord': [row[x2], row[y2]]}] for row in rows]
+        data = [[{'coord': [a, b]}, {'coord': [c, d]}]
+                for a, b, c, d in zip(*_mark_columns(data_frame, [x1, y1, x2, y2]))]
 
     base_mark_line_options = {
         'symbol': [symbol_start, symbol_end],
@@ -1540,8 +2139,7 @@ def mark_label_echarts(data_frame: pd.DataFrame, x: str, y: str, label: str, tit
     :return:
     """
     options = copy.deepcopy(ECHARTS_BASE_OVERLAY_OPTIONS)
-    rows = data_frame[[x, y, label]].to_dict(orient='records')
-    data = [{'value': row[label], 'coord': [row[x], row[y]]} for row in rows]
+    data = [{'value': name, 'coord': [a, b]} for name, a, b in zip(*_mark_columns(data_frame, [label, x, y]))]
     base_mark_point_options = {
         'symbol': 'circle',
         'symbolSize': 0,
@@ -1580,8 +2178,7 @@ def mark_vertical_line_echarts(data_frame: pd.DataFrame, x: str, label: str, tit
     :return:
     """
     options = copy.deepcopy(ECHARTS_BASE_OVERLAY_OPTIONS)
-    rows = data_frame[[x, label]].to_dict(orient='records')
-    data = [{'name': row[label], 'xAxis': row[x]} for row in rows]
+    data = [{'name': name, 'xAxis': a} for name, a in zip(*_mark_columns(data_frame, [label, x]))]
     base_mark_line_options = {
         'label': {
             'position': label_position,
@@ -1625,8 +2222,7 @@ def mark_horizontal_line_echarts(data_frame: pd.DataFrame, y: str, label: str, t
     :return:
     """
     options = copy.deepcopy(ECHARTS_BASE_OVERLAY_OPTIONS)
-    rows = data_frame[[y, label]].to_dict(orient='records')
-    data = [{'name': row[label], 'yAxis': row[y]} for row in rows]
+    data = [{'name': name, 'yAxis': a} for name, a in zip(*_mark_columns(data_frame, [label, y]))]
     base_mark_line_options = {
         'label': {
             'position': label_position,
@@ -1646,6 +2242,32 @@ def mark_horizontal_line_echarts(data_frame: pd.DataFrame, y: str, label: str, t
     return Echarts(options)
 
 
+def _series_data_3d(series: dict, data_frame: pd.DataFrame, gl_threshold: int, max_points: int = None):
+    """
+    按series['dimensions']填充3d series的data
+    全部为数值列且数据量大时输出float32二进制数据，scatter3D开启渐进渲染，bar3D开启instancing
+    """
+    dims = series['dimensions']
+    numeric = all(data_frame[dim].dtype.kind in 'iufb' for dim in dims)
+    row_count = data_frame.shape[0]
+    if numeric and (row_count > gl_threshold or (max_points is not None and row_count > max_points)):
+        values = data_frame[dims].to_numpy(dtype=float)
+        if max_points is not None:
+            values = Tools.voxel_downsample(values, max_points)
+        series['data'] = Tools.float32_data(values)
+        if series['type'] == 'bar3D':
+            series['instancing'] = True
+        else:
+            series['progressive'] = gl_threshold
+            series['progressiveThreshold'] = gl_threshold
+        return
+    if max_points is not None and row_count > max_points:
+        raise ValueError("max_points 降采样需要各列都是数值类型")
+    xyz = data_frame[dims[:3]].values.tolist()
+    extras = [data_frame[dim].tolist() for dim in dims[3:]]
+    series['data'] = [row + list(extra) for row, extra in zip(xyz, zip(*extras))] if extras else xyz
+
+
 def scatter3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str = None, z_field: str = None,
                       size_field: str = None, color_field: str = None,
                       size_range: list = [2, 10],
@@ -1662,11 +2284,14 @@ def scatter3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: st
                       x_field_scale: bool = False,
                       y_field_scale: bool = False,
                       z_field_scale: bool = False,
+                      gl_threshold: int = 100000,
+                      max_points: int = None,
                       title: str = "",
                       width: str = "100%",
                       height: str = "500px",**kwargs):
     """
     3d 气泡图
+    各列都是数值类型并且点数超过gl_threshold时，数据按float32二进制传输并开启渐进渲染
 
 
     :param data_frame:
@@ -1687,6 +2312,8 @@ def scatter3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: st
     :param z_field_log_base:
     :param y_field_log_base:
     :param x_field_log_base:
+    :param gl_threshold: 超过这个点数使用float32二进制数据和渐进渲染
+    :param max_points: 点数超过max_points时按体素网格降采样(体素内各列取均值)，需要各列都是数值类型
     :param title:
     :param width:
     :param height:
@@ -1732,16 +2359,12 @@ def scatter3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: st
     series = {
         'type': 'scatter3D',
         'name': title,
-        'dimensions': [x_field, y_field, z_field],
-        'data': data_frame[[x_field, y_field, z_field]].values.tolist()
+        'dimensions': [x_field, y_field, z_field]
     }
     if (color_field is not None) or (size_field is not None):
         options['visualMap'] = []
     if size_field is not None:
         series['dimensions'].append(size_field)
-        size_list = data_frame[size_field].tolist()
-        for i in range(0, len(size_list)):
-            series['data'][i].append(size_list[i])
         visual_map = {
             'show': True,
             'orient': 'vertical',
@@ -1761,9 +2384,6 @@ def scatter3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: st
 
     if color_field is not None:
         series['dimensions'].append(color_field)
-        color_list = data_frame[color_field].tolist()
-        for i in range(0, len(color_list)):
-            series['data'][i].append(color_list[i])
         visual_map = {
             'show': True,
             'orient': 'vertical',
@@ -1787,9 +2407,7 @@ def scatter3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: st
 
     if info is not None:
         series['dimensions'].append(info)
-        info_list = data_frame[info].tolist()
-        for i in range(0, len(info_list)):
-            series['data'][i].append(info_list[i])
+    _series_data_3d(series, data_frame, gl_threshold, max_points)
     options['series'] = [series]
     options['toolbox'] = {
         'show': True,
@@ -1807,11 +2425,13 @@ def bar3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str =
                   color_sequence: list = ["#313695", "#4575b4", "#74add1", "#abd9e9", "#e0f3f8", "#ffffbf",
                                           "#fee090",
                                           "#fdae61", "#f46d43", "#d73027", "#a50026"], info: str = None,
+                  gl_threshold: int = 100000,
                   title: str = "",
                   width: str = "100%",
                   height: str = "500px",**kwargs):
     """
     3d bar
+    各列都是数值类型并且柱数超过gl_threshold时，数据按float32二进制传输并开启instancing渲染
     :param data_frame:
     :param x_field:
     :param y_field:
@@ -1819,6 +2439,7 @@ def bar3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str =
     :param color_field:
     :param color_sequence:
     :param info:
+    :param gl_threshold: 超过这个柱数使用float32二进制数据和instancing
     :param title:
     :param width:
     :param height:
@@ -1859,7 +2480,6 @@ def bar3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str =
         'type': 'bar3D',
         'name': title,
         'dimensions': [x_field, y_field, z_field],
-        'data': data_frame[[x_field, y_field, z_field]].values.tolist(),
         'label': {
             'show': False
         },
@@ -1870,9 +2490,6 @@ def bar3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str =
     if color_field is not None:
         options['visualMap'] = []
         series['dimensions'].append(color_field)
-        color_list = data_frame[color_field].tolist()
-        for i in range(0, len(color_list)):
-            series['data'][i].append(color_list[i])
         visual_map = {
             'show': True,
             'orient': 'vertical',
@@ -1896,9 +2513,7 @@ def bar3d_echarts(data_frame: pd.DataFrame, x_field: str = None, y_field: str =
 
     if info is not None:
         series['dimensions'].append(info)
-        info_list = data_frame[info].tolist()
-        for i in range(0, len(info_list)):
-            series['data'][i].append(info_list[i])
+    _series_data_3d(series, data_frame, gl_threshold)
     options['series'] = [series]
     options['toolbox'] = {
         'show': True,
@@ -2090,43 +2705,36 @@ def drawdown_echarts(data_frame: pd.DataFrame, time_field: str, value_field: str
     return Echarts(options, height=height, width=width)
 
 
-def minute_echarts(data_frame: pd.DataFrame, time_field="time", price_field='price', volume_field="volume", title="",
+def minute_echarts(data_frame, time_field="time", price_field='price', volume_field="volume", freq="1min",
+                   title="",
                    width="100%",
                    height='500px'):
     """
-
-    :param data_frame:
+    分时图，tick数据聚合成K线后叠加均价线
+    :param data_frame: tick DataFrame, 或者按时间先后分块的tick DataFrame迭代器(一整天的tick可以分块流式聚合)
     :param time_field:
     :param price_field:
     :param volume_field:
+    :param freq: K线周期 1s/5s/1min/5min
     :param title:
     :param width:
     :param height:
     :return:
     """
-
-    def agg_ohlcv(x):
-        arr = x[price_field].values
-        names = {
-            'low': min(arr) if len(arr) > 0 else np.nan,
-            'high': max(arr) if len(arr) > 0 else np.nan,
-            'open': arr[0] if len(arr) > 0 else np.nan,
-            'close': arr[-1] if len(arr) > 0 else np.nan,
-            'volume': sum(x[volume_field].values) if len(x[volume_field].values) > 0 else 0,
-        }
-        return pd.Series(names)
-
-    df1min = data_frame.set_index(time_field).resample('1min').apply(agg_ohlcv)
-    df1min = df1min.ffill()
-    df1min['avg_price'] = (df1min['close'] * df1min['volume']).cumsum() / df1min['volume'].cumsum()
-    return candlestick_echarts(df1min[df1min['volume'] > 0], log_y=False, mas=[], title=title, width=width,
+    bars = Tools.ticks_to_bars(data_frame, time_field=time_field, price_field=price_field,
+                               volume_field=volume_field, freq=freq)
+    bars = bars[bars['volume'] > 0].copy()
+    bars['avg_price'] = bars['amount'].cumsum() / bars['volume'].cumsum()
+    return candlestick_echarts(bars, time_field=time_field, log_y=False, mas=[], title=title, width=width,
                                height=height).overlap_series(
-        [line_echarts(df1min, y_field='avg_price')])
+        [line_echarts(bars, y_field='avg_price')])
 
 
 __all__ = ['scatter_echarts', 'line_echarts', 'bar_echarts', 'pie_echarts', 'candlestick_echarts', 'radar_echarts',
-           'heatmap_echarts', 'calendar_heatmap_echarts', 'parallel_echarts', 'sankey_echarts', 'theme_river_echarts',
-           'sunburst_echarts', 'mark_area_echarts', 'mark_segment_echarts', 'mark_label_echarts',
+           'heatmap_echarts', 'corr_heatmap_echarts', 'calendar_heatmap_echarts', 'parallel_echarts', 'sankey_echarts',
+           'network_echarts',
+           'theme_river_echarts',
+           'sunburst_echarts', 'mark_layer_echarts', 'mark_area_echarts', 'mark_segment_echarts', 'mark_label_echarts',
            'mark_vertical_line_echarts', 'mark_horizontal_line_echarts', 'scatter3d_echarts', 'bar3d_echarts',
            'drawdown_echarts', 'minute_echarts','mark_background_echarts']
 
@@ -1,5 +1,11 @@
+import json
+import uuid
+
+import numpy as np
+import pandas as pd
+
 from ..g2plot import G2PLOT
-from ..base import Js, Tools
+from ..base import Js, Tools, json_type_convert
 
 
 def bullet_g2plot(title: str = "", range_field: list = [], measure_field: list = [], target_field: int = None,
@@ -76,7 +82,8 @@ def liquid_g2plot(percent: float = 1, width='200px', height='200px'):
     }, width=width, height=height)
 
 
-def wordcloud_g2plot(df, word_field: str = None, weight_field: str = None, width='100%', height='500px'):
+def wordcloud_g2plot(df, word_field: str = None, weight_field: str = None, width='100%', height='500px',
+                     top_k: int = None, others_name: str = "其他"):
     """
     词云
     :param df:
@@ -84,9 +91,16 @@ def wordcloud_g2plot(df, word_field: str = None, weight_field: str = None, width
     :param weight_field: 权重列
     :param width:
     :param height:
-    :return:
-    """
-    return G2PLOT(df, plot_type="WordCloud", options={
+    :param top_k: 重复词权重求和后只保留权重最大的top_k个词
+    :param others_name: 其余词合并成的一项的名称，None时直接丢弃
+    :return: G2PLOT, top_k_dropped 属性记录截断丢弃的 {'keys','weight','ratio'}
+    """
+    words, dropped = Tools.top_k(df, word_field, weight_field, top_k, others_name)
+    # 其他列取每个词第一次出现的行，合并项没有对应的行
+    extra = [c for c in df.columns if c not in (word_field, weight_field)]
+    if len(extra) > 0:
+        words = words.merge(df.drop_duplicates(word_field)[[word_field] + extra], on=word_field, how='left')
+    plot = G2PLOT(words, plot_type="WordCloud", reset_index=False, options={
         'wordField': word_field,
         'weightField': weight_field,
         'colorField': word_field,
@@ -102,6 +116,8 @@ def wordcloud_g2plot(df, word_field: str = None, weight_field: str = None, width
             },
         }
     }, width=width, height=height)
+    plot.top_k_dropped = dropped
+    return plot
 
 
 def column_stack_percent_g2plot(df, x_field: str = None, y_field: str = None, series_field: str = None,
@@ -236,22 +252,56 @@ def circle_packing_g2plot(df, category_field_list: list = [], value_field: str =
     return G2PLOT(root, plot_type='CirclePacking', options=options, width=width, height=height)
 
 
-def treemap_g2plot(df, category_field_list: list = [], value_field: str = None, width="100%",
-                   height='500px'):
+def treemap_g2plot(df, category_field_list: list = [], value_field: str = None, lazy_depth: int = None,
+                   width="100%", height='500px'):
     """
     treemap
     :param df: cat1,cat2,...,catN,value
     :param category_field_list:类别列表
     :param value_field:值列表
+    :param lazy_depth: 首屏只嵌入前几层，更深的节点点击时再解析展开，节点很多时使用
     :param width:
     :param height:
     :return:
     """
     data = Tools.df2tree(df, category_cols=category_field_list, value_col=value_field)
+    extra_js = ""
+    render_hooks = []
+    if lazy_depth is not None:
+        data, chunks = Tools.lazy_tree(data, lazy_depth)
     root = {
         'name': 'root',
         'children': data
     }
+    if lazy_depth is not None:
+        uid = uuid.uuid4().hex
+        root_var = f"treemap_root_{uid}"
+        extra_js = f"""
+        var {root_var} = {json.dumps(root, ensure_ascii=False, default=json_type_convert)};
+        var treemap_chunks_{uid} = {json.dumps(chunks, ensure_ascii=False)};
+        function treemap_lazy_{uid}(plot){{
+            plot.on('element:click', function(evt){{
+                var datum = evt.data && evt.data.data;
+                var key = datum && datum.lazy;
+                if (!key || !(key in treemap_chunks_{uid})) {{ return; }}
+                var names = JSON.parse(key);
+                var nodes = {root_var}.children;
+                var node = null;
+                for (var i = 0; i < names.length; i++) {{
+                    for (var j = 0; j < nodes.length; j++) {{
+                        if (nodes[j].name === names[i]) {{ node = nodes[j]; break; }}
+                    }}
+                    nodes = node.children || [];
+                }}
+                node.children = JSON.parse(treemap_chunks_{uid}[key]);
+                delete treemap_chunks_{uid}[key];
+                delete node.lazy;
+                plot.changeData({root_var});
+            }});
+        }}
+        """
+        render_hooks.append(f"treemap_lazy_{uid}")
+        root = Js(root_var)
     options = {
         'legend': {
             'position': 'top-left',
@@ -270,11 +320,13 @@ def treemap_g2plot(df, category_field_list: list = [], value_field: str = None,
         'interactions': [{'type': 'treemap-drill-down'}],
         'animation': {},
     }
-    return G2PLOT(root, plot_type='Treemap', options=options, width=width, height=height)
+    plot = G2PLOT(root, plot_type='Treemap', options=options, extra_js=extra_js, width=width, height=height)
+    plot.render_hooks = render_hooks
+    return plot
 
 
 def violin_g2plot(df, x_field: str = None, y_field: str = None, series_field: str = None, width="100%",
-                  height='500px'):
+                  height='500px', quantile_points: int = None):
     """
     小提琴图，展示y列的分布
     :param df:
@@ -283,6 +335,8 @@ def violin_g2plot(df, x_field: str = None, y_field: str = None, series_field: st
     :param series_field: 分组列
     :param width:
     :param height:
+    :param quantile_points: 样本量大时使用，每组只传输quantile_points+1个等间隔分位数点，建议取4的倍数如256,
+                            最值和四分位数保持精确，浏览器端密度估计的计算量只和分组数有关
     :return:
     """
     options = {
@@ -297,25 +351,34 @@ def violin_g2plot(df, x_field: str = None, y_field: str = None, series_field: st
     }
     if series_field is not None:
         options['seriesField'] = series_field
-
+    if quantile_points is not None:
+        group_fields = [field for field in (x_field, series_field) if field is not None]
+        df = Tools.quantile_sketch(df, group_fields, y_field, quantile_points)
+        return G2PLOT(df, plot_type='Violin', options=options, width=width, height=height, reset_index=False)
     return G2PLOT(df, plot_type='Violin', options=options, width=width, height=height)
 
 
-def line_g2plot(df, x_field=None, y_field=None, series_field=None, width='100%', height='500px'):
+def line_g2plot(df, x_field=None, y_field=None, series_field=None, width='100%', height='500px', columnar=False,
+                reset_index=True):
     """
     线图
+    :param columnar: 按列编码传输数据，数据量大时使用
+    :param reset_index: index是否作为一列输出
     """
     options = {'xField': x_field, 'yField': y_field}
     if series_field is not None:
         options['seriesField'] = series_field
-    return G2PLOT(df, plot_type='Line', options=options, width=width, height=height)
+    return G2PLOT(df, plot_type='Line', options=options, width=width, height=height, columnar=columnar,
+                  reset_index=reset_index)
 
 
 def scatter_g2plot(df, x_field=None, y_field=None, color_field=None, size_field=None, shape_field=None,
                    width='100%',
-                   height='500px'):
+                   height='500px', columnar=False, reset_index=True):
     """
     点图
+    :param columnar: 按列编码传输数据，数据量大时使用
+    :param reset_index: index是否作为一列输出
     """
     options = {'xField': x_field, 'yField': y_field}
     if color_field is not None:
@@ -324,13 +387,16 @@ def scatter_g2plot(df, x_field=None, y_field=None, color_field=None, size_field=
         options['sizeField'] = size_field
     if shape_field is not None:
         options['shapeField'] = shape_field
-    return G2PLOT(df, plot_type='Scatter', options=options, width=width, height=height)
+    return G2PLOT(df, plot_type='Scatter', options=options, width=width, height=height, columnar=columnar,
+                  reset_index=reset_index)
 
 
 def column_g2plot(df, x_field=None, y_field=None, series_field=None, is_stack=False, is_group=False, is_range=False,
-                  width='100%', height='500px'):
+                  width='100%', height='500px', columnar=False, reset_index=True):
     """
     柱状图
+    :param columnar: 按列编码传输数据，数据量大时使用
+    :param reset_index: index是否作为一列输出
     """
     options = {'xField': x_field, 'yField': y_field}
     if series_field is not None:
@@ -341,7 +407,8 @@ def column_g2plot(df, x_field=None, y_field=None, series_field=None, is_stack=Fa
         options['isGroup'] = True
     elif is_range:
         options['isRange'] = True
-    return G2PLOT(df, plot_type='Column', options=options, width=width, height=height)
+    return G2PLOT(df, plot_type='Column', options=options, width=width, height=height, columnar=columnar,
+                  reset_index=reset_index)
 
 
 def rose_g2plot(df, x_field=None, y_field=None, series_field=None, is_stack=False, is_group=False, width='100%',
@@ -407,9 +474,51 @@ def funnel_g2plot(df, x_field=None, y_field=None, width='100%', height='500px'):
     return G2PLOT(df, plot_type='Funnel', options=options, width=width, height=height)
 
 
-def histogram_g2plot(df, bin_field=None, bin_width=None, width='100%', height='500px'):
-    options = {'binField': bin_field, 'binWidth': bin_width}
-    return G2PLOT(df, plot_type='Histogram', options=options, width=width, height=height)
+def histogram_g2plot(df, bin_field=None, bin_width=None, width='100%', height='500px', bins=None, log=False,
+                     weight_field=None, series_field=None, range=None):
+    """
+    直方图
+    提供bins/log/weight_field/series_field其中之一，或者df为分块迭代器时，在python端分箱(Tools.histogram)，
+    只传输分箱边界和计数，否则原始数据传给G2Plot在浏览器端分箱
+    :param df: DataFrame, 或者DataFrame/ndarray的分块迭代器(需要提供range)
+    :param bin_field: 分箱的数值列
+    :param bin_width: 分箱宽度
+    :param width:
+    :param height:
+    :param bins: 分箱个数或者numpy分箱规则 auto/fd/sturges 等
+    :param log: 对数分箱
+    :param weight_field: 权重列，柱高为权重之和
+    :param series_field: 分组列，各组堆叠显示
+    :param range: (最小值,最大值)
+    :return:
+    """
+    server_side = bins is not None or log or weight_field is not None or series_field is not None or \
+        not isinstance(df, pd.DataFrame)
+    if not server_side:
+        options = {'binField': bin_field, 'binWidth': bin_width}
+        return G2PLOT(df, plot_type='Histogram', options=options, width=width, height=height)
+    hist = Tools.histogram(df, bin_field, bins=bins if bins is not None else 'auto', bin_width=bin_width,
+                           range=range, log=log, weight_field=weight_field, group_field=series_field)
+    labels = _edge_labels(np.append(hist['bin_start'].to_numpy()[:1], hist['bin_end'].unique()))
+    hist['range'] = np.tile(labels, len(hist) // max(len(labels), 1))
+    options = {'xField': 'range', 'yField': 'count', 'columnWidthRatio': 1,
+               'meta': {'range': {'alias': bin_field}, 'count': {'alias': weight_field or 'count'}}}
+    if series_field is not None:
+        options['seriesField'] = series_field
+        options['isStack'] = True
+    return G2PLOT(hist.drop(columns=['bin_start', 'bin_end']), plot_type='Column', options=options, width=width,
+                  height=height, reset_index=False)
+
+
+def _edge_labels(edges: np.ndarray) -> list:
+    """
+    分箱区间标签 "左边界~右边界"，数值精度自动增加直到标签不重复
+    """
+    for precision in range(4, 16):
+        texts = ['%.*g' % (precision, v) for v in edges]
+        if len(set(texts)) == len(texts):
+            break
+    return [texts[i] + '~' + texts[i + 1] for i in range(len(edges) - 1)]
 
 
 __all__ = ['bullet_g2plot', 'chord_g2plot', 'waterfall_g2plot', 'liquid_g2plot', 'wordcloud_g2plot',
@@ -1,12 +1,17 @@
 import copy
+import json
+import uuid
 
+import numpy as np
 import pandas as pd
+from ..base import Js, Tools, json_type_convert, _b64, _datetime_strings
 from ..highcharts import HighCharts
 
 
 def streamgraph_highcharts(data_frame: pd.DataFrame, time_field: str = None, series_field: str = None,
                            value_field: str = None,
-                           title: str = "", height='600px') -> HighCharts:
+                           title: str = "", height='600px', top_n: int = None, others_name: str = "其他",
+                           float32: bool = False) -> HighCharts:
     """
 
     :param data_frame:
@@ -16,30 +21,135 @@ def streamgraph_highcharts(data_frame: pd.DataFrame, time_field: str = None, ser
     :param title:
     :param width:
     :param height:
+    :param top_n: 按总量保留前top_n个序列，其余合并成一个序列
+    :param others_name: 合并序列名称，显示为 "名称(N项)"
+    :param float32: 数据按float32传输，体积减半，超过2^24的数值会损失精度
     :return:
     """
-    df = data_frame.pivot(index=time_field, columns=series_field, values=value_field).fillna(0)
-    x_category = list(df.index)
+    times, time_labels = pd.factorize(data_frame[time_field], sort=True)
+    names, series_names = pd.factorize(data_frame[series_field], sort=True)
+    valid = (times >= 0) & (names >= 0)
+    values = np.nan_to_num(data_frame[value_field].to_numpy(dtype=float)[valid])
+    # 时间x序列 二维矩阵，重复(时间,序列)求和，缺失为0
+    block = np.bincount(names[valid] * len(time_labels) + times[valid], weights=values,
+                        minlength=len(series_names) * len(time_labels)).reshape(len(series_names), len(time_labels))
+    series_names = list(series_names)
+    if top_n is not None and len(series_names) > top_n:
+        totals = pd.DataFrame({'name': np.arange(len(series_names)), 'total': block.sum(axis=1)})
+        kept, dropped = Tools.top_k(totals, 'name', 'total', top_n, others_name=None)
+        rest = np.ones(len(series_names), dtype=bool)
+        rest[kept['name'].to_numpy()] = False
+        block = np.vstack([block[kept['name'].to_numpy()], block[rest].sum(axis=0, keepdims=True)])
+        series_names = [series_names[i] for i in kept['name']] + ["%s(%d项)" % (others_name, dropped['keys'])]
+    x_axis = {'maxPadding': 0, 'type': 'category', 'crosshair': True,
+              'labels': {'align': 'left', 'reserveSpace': False, 'rotation': 270}, 'lineWidth': 0,
+              'margin': 20, 'tickWidth': 0}
+    point = {}
+    kind = time_labels.dtype.kind
+    if kind == 'M':
+        # 带时区的按当地时间计算，highcharts默认按UTC显示，和当地时间一致
+        local = time_labels.tz_localize(None) if time_labels.tz is not None else time_labels
+        ticks = local.to_numpy().astype('datetime64[ms]').astype(np.int64)
+    else:
+        ticks = time_labels.to_numpy() if kind in 'iuf' else None
+    steps = np.diff(ticks) if ticks is not None and len(ticks) > 1 else None
+    if steps is not None and (steps == steps[0]).all() and steps[0] > 0:
+        # 等间隔时间轴不输出类目数组，用起点和间隔表示
+        if kind == 'M':
+            x_axis['type'] = 'datetime'
+            point = {'pointStart': int(ticks[0]), 'pointInterval': int(steps[0])}
+        else:
+            x_axis['type'] = 'linear'
+            point = {'pointStart': ticks[0].item(), 'pointInterval': steps[0].item()}
+    elif time_labels.dtype.kind == 'M':
+        x_axis['categories'] = _datetime_strings(pd.Series(time_labels)).tolist()
+    else:
+        x_axis['categories'] = time_labels.tolist()
+    # 所有序列放在一个TypedArray里一次编码，每个序列取其中一段
+    uid = uuid.uuid4().hex
+    array_type, dtype = ('Float32Array', '<f4') if float32 else ('Float64Array', '<f8')
+    extra_js = f"""var stream_block_{uid} = (function(s){{
+        var b = atob(s), a = new Uint8Array(b.length);
+        for (var i = 0; i < b.length; i++) {{ a[i] = b.charCodeAt(i); }}
+        return new {array_type}(a.buffer);
+    }})('{_b64(block.astype(dtype).ravel())}');"""
+    step = block.shape[1]
     options = {'chart': {'type': 'streamgraph', 'marginBottom': 30, 'zoomType': 'x', 'height': height},
                'title': {'floating': True, 'align': 'left', 'text': title},
-               'xAxis': {'maxPadding': 0, 'type': 'category', 'crosshair': True,
-                         'categories': x_category,
-                         'labels': {'align': 'left', 'reserveSpace': False, 'rotation': 270}, 'lineWidth': 0,
-                         'margin': 20, 'tickWidth': 0},
+               'xAxis': x_axis,
                'yAxis': {'visible': False, 'startOnTick': False, 'endOnTick': False}, 'legend': {'enabled': False},
-               'series': []}
-    for col in df.columns:
-        data = list(df[col].values)
-        options['series'].append({'name': col, 'data': data})
-    return HighCharts(options, height=height)
+               'series': [{'name': name,
+                           'data': Js(f"Array.from(stream_block_{uid}.subarray({i * step}, {(i + 1) * step}))"),
+                           **point}
+                          for i, name in enumerate(series_names)]}
+    return HighCharts(options, extra_js=extra_js, height=height)
+
+
+def _network_links(data_frame: pd.DataFrame, from_field: str, to_field: str, weight_field: str,
+                   top_n: int = None, others_name: str = "其他"):
+    """
+    相同(from,to)的权重求和，节点按流量(流入+流出)排序，top_n之外的节点合并成一个节点
+    :return: (节点名称list, from下标, to下标, 权重) 合并节点内部的边丢弃
+    """
+    row_count = data_frame.shape[0]
+    codes, names = pd.factorize(pd.concat([data_frame[from_field], data_frame[to_field]], ignore_index=True))
+    source, target = codes[:row_count].astype(np.int64), codes[row_count:].astype(np.int64)
+    weights = data_frame[weight_field].to_numpy(dtype=float)
+    valid = (source >= 0) & (target >= 0) & ~np.isnan(weights)
+    source, target, weights = source[valid], target[valid], weights[valid]
+    names = list(names)
+    if top_n is not None and len(names) > top_n:
+        flow = np.bincount(source, weights=weights, minlength=len(names)) + \
+               np.bincount(target, weights=weights, minlength=len(names))
+        order = np.argsort(-flow, kind='stable')
+        mapping = np.full(len(names), top_n, dtype=np.int64)
+        mapping[order[:top_n]] = np.arange(top_n)
+        source, target = mapping[source], mapping[target]
+        keep = (source != top_n) | (target != top_n)
+        source, target, weights = source[keep], target[keep], weights[keep]
+        names = [names[i] for i in order[:top_n]] + ["%s(%d项)" % (others_name, len(names) - top_n)]
+    keys, inverse = np.unique(source * len(names) + target, return_inverse=True)
+    return names, keys // len(names), keys % len(names), np.bincount(inverse, weights=weights, minlength=len(keys))
+
+
+def _network_data(data_frame: pd.DataFrame, from_field: str, to_field: str, weight_field: str, top_n: int,
+                  others_name: str):
+    """
+    节点名称通过extra_js声明一次，边按下标数组输出，浏览器端还原成[from,to,weight]
+    :return: (extra_js, Js)
+    """
+    names, source, target, weights = _network_links(data_frame, from_field, to_field, weight_field, top_n,
+                                                    others_name)
+    nodes_var = f"network_nodes_{uuid.uuid4().hex}"
+    extra_js = f"var {nodes_var} = {json.dumps(names, ensure_ascii=False, default=json_type_convert)};"
+    data = Js("(function(n,s,t,w){var r=new Array(s.length);for(var i=0;i<s.length;i++){"
+              "r[i]=[n[s[i]],n[t[i]],w[i]];}return r;})(%s,%s,%s,%s)" % (
+                  nodes_var,
+                  json.dumps(source.tolist(), separators=(',', ':')),
+                  json.dumps(target.tolist(), separators=(',', ':')),
+                  json.dumps(weights.tolist(), separators=(',', ':'))))
+    return extra_js, data
 
 
 def dependency_wheel_highcharts(data_frame: pd.DataFrame, from_field=None, to_field=None, weight_field=None,
-                                title="", height='600px') -> HighCharts:
+                                title="", height='600px', top_n: int = None, others_name: str = "其他") -> HighCharts:
+    """
+    依赖轮图，相同(from,to)的权重求和
+    :param data_frame:
+    :param from_field:
+    :param to_field:
+    :param weight_field:
+    :param title:
+    :param height:
+    :param top_n: 按流量保留前top_n个节点，其余节点合并成一个节点
+    :param others_name: 合并节点名称，显示为 "名称(N项)"
+    :return:
+    """
+    extra_js, data = _network_data(data_frame, from_field, to_field, weight_field, top_n, others_name)
     options = {'title': {'text': title},
                'chart': {'height': height},
                'series': [{'keys': ['from', 'to', 'weight'],
-                           'data': data_frame[[from_field, to_field, weight_field]].values(),
+                           'data': data,
                            'type': 'dependencywheel',
                            'name': title,
                            'dataLabels': {'color': '#333',
@@ -49,17 +159,30 @@ def dependency_wheel_highcharts(data_frame: pd.DataFrame, from_field=None, to_fi
                                                   'dy': 5}},
                                           'distance': 10},
                            'size': '95%'}]}
-    return HighCharts(options)
+    return HighCharts(options, extra_js=extra_js)
 
 
 def arcdiagram_highcharts(data_frame: pd.DataFrame, from_field=None, to_field=None, weight_field=None,
-                          title="", height='600px') -> HighCharts:
+                          title="", height='600px', top_n: int = None, others_name: str = "其他") -> HighCharts:
+    """
+    弧线图，相同(from,to)的权重求和
+    :param data_frame:
+    :param from_field:
+    :param to_field:
+    :param weight_field:
+    :param title:
+    :param height:
+    :param top_n: 按流量保留前top_n个节点，其余节点合并成一个节点
+    :param others_name: 合并节点名称，显示为 "名称(N项)"
+    :return:
+    """
+    extra_js, data = _network_data(data_frame, from_field, to_field, weight_field, top_n, others_name)
     options = {'title': {'text': title}, 'chart': {'height': height}, 'series': [
         {'keys': ['from', 'to', 'weight'], 'type': 'arcdiagram', 'name': title, 'linkWeight': 1,
          'centeredLinks': True, 'dataLabels': {'rotation': 90, 'y': 30, 'align': 'left', 'color': 'black'},
          'offset': '65%',
-         'data': data_frame[[from_field, to_field, weight_field]].values()}]}
-    return HighCharts(options)
+         'data': data}]}
+    return HighCharts(options, extra_js=extra_js)
 
 
 __all__ = ['streamgraph_highcharts', 'arcdiagram_highcharts', 'dependency_wheel_highcharts']
@@ -5,7 +5,7 @@ import uuid
 
 import pandas as pd
 
-from .base import Tools, Html
+from .base import Tools, Html, Js
 
 G2PLOT_JS_URL: str = "https://cdn.staticfile.org/g2plot/2.4.25/g2plot.min.js"
 
@@ -19,24 +19,42 @@ class G2PLOT(object):
     """
 
     def __init__(self, data=None, plot_type: str = None, options: dict = {}, extra_js: str = "", width: str = "100%",
-                 height: str = "500px"):
+                 height: str = "500px", columnar: bool = False, reset_index: bool = True):
         """
         :param options: python词典类型的echarts option
         :param extra_js: 复杂图表需要声明定义额外js函数的，通过这个字段传递
         :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
         :param height: 输出div的高度 支持像素和百分比 比如800px/100%
+        :param columnar: DataFrame按列编码传输，浏览器端再还原成records，数据量大时使用
+        :param reset_index: DataFrame的index是否作为一列输出，图表不用index时设为False
         """
+        self.plot_id = "u" + uuid.uuid4().hex
         if isinstance(data, pd.DataFrame):
-            data = data.reset_index().to_dict(orient='records')
+            if reset_index:
+                data = data.reset_index()
+            if columnar:
+                data_var = f"data_{self.plot_id}"
+                extra_js = f"var {data_var} = {Tools.columnar_js(data)};" + extra_js
+                data = Js(data_var)
+            else:
+                data = data.to_dict(orient='records')
         self.options = options
         self.options['data'] = data
         self.plot_type = plot_type
         self.js_options = ""
         self.width = width
         self.height = height
-        self.plot_id = "u" + uuid.uuid4().hex
         self.js_url = G2PLOT_JS_URL
         self.extra_js = extra_js
+        # 图表实例创建后依次调用的js函数名，函数需在extra_js中定义，唯一参数为图表实例
+        self.render_hooks = []
+
+    def render_hooks_js(self) -> str:
+        """
+        生成图表实例创建后调用render_hooks的js语句
+        :return:
+        """
+        return "".join([f"{hook}(plot_{self.plot_id});" for hook in self.render_hooks])
 
     def print_options(self, drop_data=False):
         """
@@ -82,10 +100,11 @@ class G2PLOT(object):
         </style>
         <div id="{plot.plot_id}"></div>
         <script>
-          {{plot.extra_js}}
+          {plot.extra_js}
           require(['G2Plot'], function (G2Plot) {{
             var plot_{plot.plot_id} = new G2Plot.{plot.plot_type}("{plot.plot_id}", {plot.js_options}) 
             plot_{plot.plot_id}.render();
+            {plot.render_hooks_js()}
           }});
         </script>
         """
@@ -120,6 +139,7 @@ class G2PLOT(object):
             }}).then(() => {{
               var plot_{plot.plot_id} = new G2Plot.{plot.plot_type}("{plot.plot_id}", {plot.js_options}) 
               plot_{plot.plot_id}.render();
+              {plot.render_hooks_js()}
             }});
             </script>
             """
@@ -152,6 +172,7 @@ class G2PLOT(object):
              {plot.extra_js}
              var plot_{plot.plot_id} = new G2Plot.{plot.plot_type}("{plot.plot_id}", {plot.js_options}) 
              plot_{plot.plot_id}.render();
+             {plot.render_hooks_js()}
           </script>
         </body>
         </html>
@@ -179,6 +200,7 @@ class G2PLOT(object):
             {plot.extra_js}
             var plot_{plot.plot_id} = new G2Plot.{plot.plot_type}("{plot.plot_id}", {plot.js_options}) 
             plot_{plot.plot_id}.render();
+            {plot.render_hooks_js()}
           </script>
         </div>
         """
@@ -211,6 +233,7 @@ class G2PLOT(object):
               require(['G2Plot'], function (G2Plot) {{
                 var plot_{plot.plot_id} = new G2Plot.{plot.plot_type}("{plot.plot_id}", options_{plot.plot_id}); 
                 plot_{plot.plot_id}.render();
+                {plot.render_hooks_js()}
               }});
           }}else{{
             new Promise(function(resolve, reject) {{
@@ -222,6 +245,7 @@ class G2PLOT(object):
             }}).then(() => {{
                var plot_{plot.plot_id} = new G2Plot.{plot.plot_type}("{plot.plot_id}", options_{plot.plot_id}); 
                plot_{plot.plot_id}.render();
+               {plot.render_hooks_js()}
             }});
           }}
         </script>
@@ -3,8 +3,53 @@
 import copy
 import uuid
 
+import numpy as np
+
 from .base import Tools, Html
 
+HIGHCHARTS_JS_URL: str = "https://code.highcharts.com/highcharts.js"
+HIGHCHARTS_MODULES = ['streamgraph', 'sankey', 'arc-diagram', 'dependency-wheel']
+# boost模块支持的序列类型
+BOOST_SERIES_TYPES = {'line', 'area', 'arearange', 'column', 'columnrange', 'bar', 'scatter', 'heatmap', 'bubble',
+                      'treemap'}
+
+
+def _flat_data(data):
+    """
+    序列数据转成纯数值数组(y列表或[x,y]列表)，boost和turbo模式都要求纯数值，转换失败原样返回
+    """
+    if len(data) > 0 and isinstance(data[0], dict):
+        keys = set(data[0].keys())
+        if keys not in ({'y'}, {'x', 'y'}):
+            return data
+        data = [d['y'] for d in data] if keys == {'y'} else [[d['x'], d['y']] for d in data]
+    try:
+        values = np.asarray(data, dtype=float)
+    except (TypeError, ValueError):
+        return data
+    if values.ndim > 2:
+        return data
+    # NaN转成None，highcharts当作缺失点
+    return np.where(np.isnan(values), None, values.astype(object)).tolist() if np.isnan(values).any() \
+        else values.tolist()
+
+
+def highcharts_loader_js(urls: list) -> str:
+    """
+    按顺序加载脚本，模块依赖highcharts主文件，需要在主文件加载完成后再加载
+    """
+    return f"""{urls}.reduce(function(previous, src){{
+                return previous.then(function(){{
+                    return new Promise(function(resolve, reject){{
+                        var script = document.createElement("script");
+                        script.onload = resolve;
+                        script.onerror = reject;
+                        script.src = src;
+                        document.head.appendChild(script);
+                    }});
+                }});
+            }}, Promise.resolve())"""
+
 
 class HighCharts(object):
     """
@@ -12,14 +57,17 @@ class HighCharts(object):
     """
 
     def __init__(self, options: dict = None, extra_js: str = "", width: str = "100%",
-                 height: str = "500px"):
+                 height: str = "500px", boost_threshold: int = 5000):
         """
         :param options: python词典类型的echarts option
         :param extra_js: 复杂图表需要声明定义额外js函数的，通过这个字段传递
         :param width: 输出div的宽度 支持像素和百分比 比如800px/100%
         :param height: 输出div的高度 支持像素和百分比 比如800px/100%
+        :param boost_threshold: 序列点数超过这个值时数据转成纯数值数组，关闭turboThreshold限制，支持的序列类型启用boost模块
         """
         self.options = options
+        self.boost_threshold = boost_threshold
+        self.modules = list(HIGHCHARTS_MODULES)
         self.js_options = ""
         self.width = width
         self.height = height
@@ -39,20 +87,61 @@ class HighCharts(object):
                 dict_options['series'][i]['data'] = []
         Tools.convert_js_to_dict(Tools.convert_dict_to_js(dict_options), print_dict=True)
 
+    def boost_options(self) -> dict:
+        """
+        大数据量序列转换: 数据转成纯数值数组，turboThreshold设为0(对象数据点超过默认1000点不再静默不画)，
+        支持boost的序列设置boostThreshold并加载boost模块
+        :return: 转换后的options，没有大数据量序列时原样返回
+        """
+        options = self.options
+        series_list = options.get('series', []) if isinstance(options, dict) else []
+        large = [isinstance(s, dict) and isinstance(s.get('data'), (list, tuple, np.ndarray))
+                 and len(s['data']) > self.boost_threshold for s in series_list]
+        self.modules = list(HIGHCHARTS_MODULES)
+        if not any(large):
+            return options
+        options = dict(options)
+        default_type = options.get('chart', {}).get('type', 'line')
+        boosted = False
+        series_list = [dict(s) if is_large else s for s, is_large in zip(series_list, large)]
+        for series, is_large in zip(series_list, large):
+            if not is_large:
+                continue
+            series['data'] = _flat_data(series['data'])
+            series.setdefault('turboThreshold', 0)
+            if series.get('type', default_type) in BOOST_SERIES_TYPES:
+                series.setdefault('boostThreshold', self.boost_threshold)
+                boosted = True
+        options['series'] = series_list
+        if boosted:
+            options['boost'] = {'useGPUTranslations': True, 'usePreallocated': True, **options.get('boost', {})}
+            # boost模块需要最后加载
+            self.modules.append('boost')
+        return options
+
     def dump_options(self):
         """
          导出 js option字符串表示
         :return:
         """
-        self.js_options = Tools.convert_dict_to_js(self.options)
+        self.js_options = Tools.convert_dict_to_js(self.boost_options())
         return self.js_options
 
+    def require_modules(self) -> str:
+        return str(['highcharts'] + [f"highcharts/modules/{m}" for m in self.modules])
+
+    def script_urls(self) -> list:
+        return [HIGHCHARTS_JS_URL] + [f"https://code.highcharts.com/modules/{m}.js" for m in self.modules]
+
+    def script_tags(self) -> str:
+        return "\n".join([f'<script src="{url}"></script>' for url in self.script_urls()])
+
     def render_notebook(self) -> Html:
         """
         在jupyter notebook 环境输出
         :return:
         """
-        self.js_options = Tools.convert_dict_to_js(self.options)
+        self.dump_options()
         plot = self
         html = f"""
         <style>
@@ -72,7 +161,7 @@ class HighCharts(object):
                         'highcharts': 'https://code.highcharts.com'
                     }}
                }});
-              require(['highcharts','highcharts/modules/streamgraph','highcharts/modules/arc-diagram','highcharts/modules/sankey','highcharts/modules/dependency-wheel'], function (Highcharts) {{
+              require({plot.require_modules()}, function (Highcharts) {{
                 {plot.extra_js}
                 var options_{plot.plot_id} = {plot.js_options};
                 Highcharts.chart('{plot.plot_id}',options_{plot.plot_id})
@@ -86,7 +175,7 @@ class HighCharts(object):
         在jupyterlab 环境输出
         :return:
         """
-        self.js_options = Tools.convert_dict_to_js(self.options)
+        self.dump_options()
         plot = self
         html = f"""
             <style>
@@ -98,33 +187,7 @@ class HighCharts(object):
             <div id="{plot.plot_id}"></div>
               <script>
                 // load javascript
-                new Promise(function(resolve, reject) {{
-                  var script = document.createElement("script");
-                  script.onload = resolve;
-                  script.onerror = reject;
-                  script.src = "https://code.highcharts.com/highcharts.js";
-                  document.head.appendChild(script);
-                  var scriptSG = document.createElement("script");
-                      scriptSG.onload = resolve;
-                      scriptSG.onerror = reject;
-                      scriptSG.src = "https://code.highcharts.com/modules/streamgraph.js";
-                      document.head.appendChild(scriptSG);
-                  var wheel = document.createElement("script");
-                      scriptSG.onload = resolve;
-                      scriptSG.onerror = reject;
-                      scriptSG.src = "https://code.highcharts.com/modules/dependency-wheel.js";
-                      document.head.appendChild(wheel);
-                  var sankey = document.createElement("script");
-                      scriptSG.onload = resolve;
-                      scriptSG.onerror = reject;
-                      scriptSG.src = "https://code.highcharts.com/modules/sankey.js";
-                      document.head.appendChild(sankey);
-                  var arc_diagram = document.createElement("script");
-                      scriptSG.onload = resolve;
-                      scriptSG.onerror = reject;
-                      scriptSG.src = "https://code.highcharts.com/modules/arc-diagram.js";
-                      document.head.appendChild(arc_diagram);
-                }}).then(() => {{
+                """ + highcharts_loader_js(plot.script_urls()) + f""".then(() => {{
                    {plot.extra_js}
                    var options_{plot.plot_id} = {plot.js_options};
                    Highcharts.chart('{plot.plot_id}',options_{plot.plot_id})
@@ -138,7 +201,7 @@ class HighCharts(object):
         渲染html字符串，可以用于 streamlit
         :return:
         """
-        self.js_options = Tools.convert_dict_to_js(self.options)
+        self.dump_options()
         plot = self
         html = f"""
         <!DOCTYPE html>
@@ -152,11 +215,7 @@ class HighCharts(object):
                     height:{plot.height};
                  }}
             </style>
-        <script src="https://code.highcharts.com/highcharts.js"></script>
-        <script src="https://code.highcharts.com/modules/streamgraph.js"></script>
-        <script src="https://code.highcharts.com/modules/dependency-wheel.js"></script>
-         <script src="https://code.highcharts.com/modules/arc-diagram.js"></script>
-         <script src="https://code.highcharts.com/modules/sankey.js"></script>
+        {plot.script_tags()}
         </head>
         <body>
           <div id="{plot.plot_id}" ></div>
@@ -175,15 +234,11 @@ class HighCharts(object):
         渲染html 片段，方便一个网页输出多个图表
         :return:
         """
-        self.js_options = Tools.convert_dict_to_js(self.options)
+        self.dump_options()
         plot = self
         html = f"""
         <div>
-        <script src="https://code.highcharts.com/highcharts.js"></script>
-        <script src="https://code.highcharts.com/modules/streamgraph.js"></script>
-        <script src="https://code.highcharts.com/modules/dependency-wheel.js"></script>
-         <script src="https://code.highcharts.com/modules/arc-diagram.js"></script>
-         <script src="https://code.highcharts.com/modules/sankey.js"></script>
+        {plot.script_tags()}
          <style>
               #{plot.plot_id} {{
                     width:{plot.width};
@@ -205,7 +260,7 @@ class HighCharts(object):
         jupyter 环境，直接输出
         :return:
         """
-        self.js_options = Tools.convert_dict_to_js(self.options)
+        self.dump_options()
         plot = self
         html = f"""
         <script>
@@ -233,38 +288,11 @@ class HighCharts(object):
                         'highcharts': 'https://code.highcharts.com'
                     }}
                }});
-              require(['highcharts','highcharts/modules/streamgraph','highcharts/modules/arc-diagram','highcharts/modules/sankey','highcharts/modules/dependency-wheel'], function (Highcharts) {{
+              require({plot.require_modules()}, function (Highcharts) {{
                 Highcharts.chart('{plot.plot_id}',options_{plot.plot_id})
               }});
           }}else{{
-            new Promise(function(resolve, reject) {{
-                 var script = document.createElement("script");
-              script.onload = resolve;
-              script.onerror = reject;
-              script.src = "https://code.highcharts.com/highcharts.js";
-              document.head.appendChild(script);
-              var scriptSG = document.createElement("script");
-                  scriptSG.onload = resolve;
-                  scriptSG.onerror = reject;
-                  scriptSG.src = "https://code.highcharts.com/modules/streamgraph.js";
-                  document.head.appendChild(scriptSG);
-              var wheel = document.createElement("script");
-                  scriptSG.onload = resolve;
-                  scriptSG.onerror = reject;
-                  scriptSG.src = "https://code.highcharts.com/modules/dependency-wheel.js";
-                  document.head.appendChild(wheel);
-              var sankey = document.createElement("script");
-                  scriptSG.onload = resolve;
-                  scriptSG.onerror = reject;
-                  scriptSG.src = "https://code.highcharts.com/modules/sankey.js";
-                  document.head.appendChild(sankey);
-              var arc_diagram = document.createElement("script");
-                  scriptSG.onload = resolve;
-                  scriptSG.onerror = reject;
-                  scriptSG.src = "https://code.highcharts.com/modules/arc-diagram.js";
-                  document.head.appendChild(arc_diagram);
-            
-            }}).then(() => {{
+            """ + highcharts_loader_js(plot.script_urls()) + f""".then(() => {{
                 {plot.extra_js}
                Highcharts.chart('{plot.plot_id}',options_{plot.plot_id})
             }});
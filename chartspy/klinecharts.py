@@ -2,6 +2,7 @@
 # coding=utf-8
 import uuid
 
+import numpy as np
 import pandas as pd
 
 from .base import Tools, Html
@@ -9,10 +10,64 @@ from .base import Tools, Html
 KlineCharts_JS_URL: str = "https://cdn.jsdelivr.net/npm/klinecharts@latest/dist/klinecharts.min.js"
 
 
+KLINE_FIELDS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'turnover']
+
+
+def kline_timestamp(values) -> np.ndarray:
+    """
+    时间列转成klinecharts需要的毫秒时间戳(按东八区时间处理)
+    :param values: 时间列
+    :return: int64 毫秒时间戳数组
+    """
+    times = pd.to_datetime(pd.Series(values)) - pd.Timedelta(hours=8)
+    return times.to_numpy().astype('datetime64[ms]').astype(np.int64)
+
+
+def kline_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    只保留K线字段，时间转成毫秒时间戳并按时间排序
+    价格转float32，成交量/成交额保持原类型，其他列忽略
+    :param df: [timestamp,open,high,low,close,volume,turnover]
+    :return:
+    """
+    columns = [field for field in KLINE_FIELDS if field in df.columns]
+    data = pd.DataFrame({field: df[field].to_numpy() for field in columns})
+    data['timestamp'] = kline_timestamp(data['timestamp'])
+    data = data.sort_values(by=['timestamp'], kind='stable')
+    for field in ('open', 'high', 'low', 'close'):
+        if field in data.columns:
+            data[field] = data[field].astype(np.float32)
+    return data
+
+
+def kline_data_js(df: pd.DataFrame) -> str:
+    """
+    K线数据按列编码成js表达式，浏览器端还原成KLineData数组
+    时间戳为毫秒整数(按float64传输，2^53以内精确)，价格float32，成交量/成交额float64，其他列忽略
+    :param df: [timestamp,open,high,low,close,volume,turnover]
+    :return: js表达式字符串
+    """
+    return Tools.columnar_js(kline_frame(df))
+
+
+def kline_pages_js(data: pd.DataFrame, page_size: int) -> str:
+    """
+    较早的K线按page_size切块，每块包装成函数，加载更多时才解码
+    :param data: kline_frame 处理后的K线
+    :param page_size: 每块条数
+    :return: js数组表达式，从早到晚排列
+    """
+    ends = reversed(range(len(data), 0, -page_size))
+    pages = [f"function(){{ return {Tools.columnar_js(data.iloc[max(end - page_size, 0):end])}; }}"
+             for end in ends]
+    return "[" + ",\n".join(pages) + "]"
+
+
 # language=jinja2
 
 def kline_chart_segment(plot):
     parts = []
+    parts.append(f"""var data_{plot.plot_id} = {plot.data};""")
     parts.append(
         f"""var chart_{plot.plot_id} = klinecharts.init("{plot.plot_id}",
         {{
@@ -38,7 +93,38 @@ def kline_chart_segment(plot):
             parts.append(f"""
             chart_{plot.plot_id}.createShape({{name: 'segment',points:[{{timestamp:{seg['start_time']},value:{seg['start_price']}}},{{timestamp:{seg['end_time']},value:{seg['end_price']}}}]}},"candle_pane")
             """)
-    parts.append(f"""chart_{plot.plot_id}.applyNewData(data_{plot.plot_id})""")
+    if plot.data_url is not None:
+        parts.append(f"""
+        chart_{plot.plot_id}.loadMore(function(timestamp){{
+            fetch("{plot.data_url}?before=" + timestamp + "&limit={plot.page_size}")
+                .then(function(response){{ return response.json(); }})
+                .then(function(cols){{
+                    var names = Object.keys(cols), n = cols.timestamp.length, rows = new Array(n);
+                    for (var i = 0; i < n; i++) {{
+                        var row = {{}};
+                        for (var j = 0; j < names.length; j++) {{ row[names[j]] = cols[names[j]][i]; }}
+                        rows[i] = row;
+                    }}
+                    chart_{plot.plot_id}.applyMoreData(rows, n >= {plot.page_size});
+                }});
+        }});
+        chart_{plot.plot_id}.applyNewData(data_{plot.plot_id}, true)""")
+    elif plot.pages is not None:
+        parts.append(f"""
+        var pages_{plot.plot_id} = {plot.pages};
+        chart_{plot.plot_id}.loadMore(function(timestamp){{
+            var page = pages_{plot.plot_id}.pop();
+            chart_{plot.plot_id}.applyMoreData(page ? page() : [], pages_{plot.plot_id}.length > 0);
+        }});
+        chart_{plot.plot_id}.applyNewData(data_{plot.plot_id}, pages_{plot.plot_id}.length > 0)""")
+    else:
+        parts.append(f"""chart_{plot.plot_id}.applyNewData(data_{plot.plot_id})""")
+    if plot.stream_url is not None:
+        parts.append(f"""
+        new EventSource("{plot.stream_url}").onmessage = function(event){{
+            var bars = JSON.parse(event.data);
+            for (var i = 0; i < bars.length; i++) {{ chart_{plot.plot_id}.updateData(bars[i]); }}
+        }};""")
     return "\n".join(parts)
 
 
@@ -50,7 +136,8 @@ class KlineCharts(object):
     def __init__(self, df: pd.DataFrame, mas=[5, 10, 30, 60, 120, 250], main_indicators=["MA"],
                  bottom_indicators=["VOL", "MACD"], df_segments: pd.DataFrame = None,
                  extra_js: str = "", width: str = "100%",
-                 height: str = "500px"):
+                 height: str = "500px", page_size: int = None, data_url: str = None,
+                 stream_url: str = None):
         """
         k线图
         :param df: [open,high,low,close,volume,turnover,timestamp]
@@ -61,18 +148,27 @@ class KlineCharts(object):
         :param extra_js:
         :param width:
         :param height:
+        :param page_size: 分页模式，初始只嵌入最近page_size根K线，向左拖动时再按块加载更早的K线
+        :param data_url: 分页数据地址(ChartServer.add_kline_store返回值)，不传则更早的K线按块嵌入页面，加载时才解码
+        :param stream_url: 实时K线推送地址(ChartServer.add_bar_stream返回的stream.url)，页面订阅后增量更新最新K线
         """
-        data = df.copy()
-        data['timestamp'] = (pd.to_datetime(data['timestamp']) - pd.Timedelta(hours=8)).view("i8") // 10 ** 6
-        data = data.sort_values(by=['timestamp'])
         if len(mas) > 0 and "MA" not in main_indicators:
             main_indicators.append("MA")
-        self.data = Tools.convert_dict_to_js(data.to_dict(orient='records'))
+        self.page_size = page_size
+        self.data_url = data_url
+        self.stream_url = stream_url
+        self.pages = None
+        if page_size is None:
+            self.data = kline_data_js(df)
+        else:
+            data = kline_frame(df)
+            self.data = Tools.columnar_js(data.iloc[-page_size:])
+            if data_url is None and len(data) > page_size:
+                self.pages = kline_pages_js(data.iloc[:-page_size], page_size)
         if df_segments is not None:
             df_seg = df_segments.copy()
-            df_seg['start_time'] = (pd.to_datetime(df_seg['start_time']) - pd.Timedelta(hours=8)).view(
-                "i8") // 10 ** 6
-            df_seg['end_time'] = (pd.to_datetime(df_seg['end_time']) - pd.Timedelta(hours=8)).view("i8") // 10 ** 6
+            df_seg['start_time'] = kline_timestamp(df_seg['start_time'])
+            df_seg['end_time'] = kline_timestamp(df_seg['end_time'])
             self.segments = df_seg.to_dict(orient='records')
         else:
             self.segments = []
@@ -109,7 +205,6 @@ class KlineCharts(object):
         <div id="{plot.plot_id}"></div>
         <script>
           {plot.extra_js}
-          var data_{plot.plot_id} = {plot.data}
           require(['klinecharts'], function (klinecharts) {{
             """ + kline_chart_segment(plot) + f"""
           }});
@@ -221,7 +316,6 @@ class KlineCharts(object):
         <div id="{plot.plot_id}"></div>
         <script>
           {plot.extra_js}
-          var data_{plot.plot_id} = {plot.data}
           if (typeof require !== 'undefined'){{
               require.config({{
                 paths: {{
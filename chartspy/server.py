@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# coding=utf-8
+import hmac
+import json
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote, unquote
+
+import numpy as np
+import pandas as pd
+
+from .base import json_type_convert
+from .klinecharts import KLINE_FIELDS, kline_timestamp
+
+
+def _read_store(data) -> pd.DataFrame:
+    """
+    读取本地数据，支持DataFrame、parquet文件、numpy的npz文件
+    :param data: DataFrame 或 文件路径
+    :return:
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    path = str(data)
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as arrays:
+            return pd.DataFrame({name: arrays[name] for name in arrays.files})
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    raise ValueError(f"不支持的数据文件: {path}, 只支持 .parquet .npz")
+
+
+def _column_list(values: np.ndarray) -> list:
+    """
+    numpy列转成json可以序列化的list, NaN转成null
+    """
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        return np.where(np.isnan(values), None, values.astype(object)).tolist()
+    return values.tolist()
+
+
+class _KlineStore(object):
+    """
+    按时间排好序的K线列存储，按时间戳二分查找分页
+    """
+
+    def __init__(self, data):
+        df = _read_store(data)
+        columns = [field for field in KLINE_FIELDS if field in df.columns]
+        timestamps = kline_timestamp(df['timestamp'])
+        order = np.argsort(timestamps, kind='stable')
+        self.columns = {'timestamp': timestamps[order]}
+        for field in columns:
+            if field != 'timestamp':
+                self.columns[field] = df[field].to_numpy()[order]
+
+    def page(self, before: int, limit: int) -> dict:
+        """
+        取时间戳早于before的最近limit根K线
+        :param before: 毫秒时间戳
+        :param limit: 条数
+        :return: {列名: list}
+        """
+        end = int(np.searchsorted(self.columns['timestamp'], before, side='left'))
+        start = max(end - limit, 0)
+        return {name: _column_list(values[start:end]) for name, values in self.columns.items()}
+
+    def handle(self, handler, params: dict):
+        before = int(params.get('before', [2 ** 62])[0])
+        limit = min(int(params.get('limit', [1000])[0]), 100000)
+        _send_json(handler, self.page(before, limit))
+
+
+_TABLE_PARAM = re.compile(r"^(sort|filter)\[(\d+)\]\[(\w+)\]")
+
+
+def _table_params(params: dict) -> tuple:
+    """
+    解析tabulator远程模式的请求参数 sort[0][field]=x&sort[0][dir]=asc&filter[0][field]=x&filter[0][type]=like&filter[0][value]=y
+    :return: (排序[(field,dir)], 过滤[(field,type,value)])
+    """
+    items = {'sort': {}, 'filter': {}}
+    for key, values in params.items():
+        match = _TABLE_PARAM.match(key)
+        if match is None:
+            continue
+        kind, index, attr = match.group(1), int(match.group(2)), match.group(3)
+        item = items[kind].setdefault(index, {})
+        if attr == 'value' and key != match.group(0):
+            item.setdefault('value', []).extend(values)
+        else:
+            item[attr] = values[0]
+    sorters = tuple((item['field'], item.get('dir', 'asc')) for _, item in sorted(items['sort'].items()))
+    filters = tuple((item['field'], item.get('type', '='),
+                     tuple(item['value']) if isinstance(item.get('value'), list) else item.get('value', ''))
+                    for _, item in sorted(items['filter'].items()))
+    return sorters, filters
+
+
+class _TableStore(object):
+    """
+    表格数据远程分页，排序/过滤结果缓存为行号数组，翻页只取当前页的行
+    """
+
+    def __init__(self, df: pd.DataFrame, cache_size: int = 32):
+        self.df = df.reset_index(drop=True)
+        self.cache_size = cache_size
+        self.positions = OrderedDict()
+        self.strings = {}
+        self.lock = threading.Lock()
+
+    def _strings(self, field: str) -> pd.Series:
+        if field not in self.strings:
+            self.strings[field] = self.df[field].astype(str).str.lower()
+        return self.strings[field]
+
+    def _mask(self, field: str, type: str, value) -> np.ndarray:
+        column = self.df[field]
+        if type == 'like':
+            return self._strings(field).str.contains(str(value).lower(), regex=False).to_numpy()
+        if type == 'starts':
+            return self._strings(field).str.startswith(str(value).lower()).to_numpy()
+        if type == 'ends':
+            return self._strings(field).str.endswith(str(value).lower()).to_numpy()
+        if type == 'regex':
+            return column.astype(str).str.contains(str(value), regex=True).to_numpy()
+        if type == 'in':
+            values = value if isinstance(value, tuple) else (value,)
+            return self._strings(field).isin([str(v).lower() for v in values]).to_numpy()
+        if column.dtype.kind in 'iufb':
+            value = float(value)
+        elif column.dtype.kind == 'M':
+            value = pd.Timestamp(value)
+        else:
+            column = column.astype(str)
+        ops = {'=': np.equal, '!=': np.not_equal, '<': np.less, '<=': np.less_equal, '>': np.greater,
+               '>=': np.greater_equal}
+        if type not in ops:
+            raise ValueError(f"不支持的过滤类型: {type}")
+        return ops[type](column, value).to_numpy(dtype=bool)
+
+    def _cached(self, key: tuple, compute) -> np.ndarray:
+        with self.lock:
+            if key in self.positions:
+                self.positions.move_to_end(key)
+                return self.positions[key]
+        value = compute()
+        with self.lock:
+            self.positions[key] = value
+            if len(self.positions) > self.cache_size:
+                self.positions.popitem(last=False)
+        return value
+
+    def _order(self, sorters: tuple) -> np.ndarray:
+        if len(sorters) == 0:
+            return np.arange(len(self.df))
+        # tabulator 第一个排序条件优先级最高
+        return self.df.sort_values(by=[field for field, _ in sorters],
+                                   ascending=[direction != 'desc' for _, direction in sorters],
+                                   kind='stable').index.to_numpy()
+
+    def rows(self, sorters: tuple, filters: tuple) -> np.ndarray:
+        """
+        排序、过滤后的行号，排序行号、每个过滤条件、组合结果分别缓存，翻页和修改过滤条件不用重新排序
+        """
+        def compute():
+            order = self._cached(('sort', sorters), lambda: self._order(sorters))
+            if len(filters) == 0:
+                return order
+            mask = np.logical_and.reduce([self._cached(('filter', f), lambda f=f: self._mask(*f)) for f in filters])
+            return order[mask[order]]
+
+        return self._cached(('rows', sorters, filters), compute)
+
+    def page(self, page: int, size: int, sorters: tuple = (), filters: tuple = ()) -> dict:
+        """
+        取一页数据
+        :param page: 页码 从1开始
+        :param size: 每页条数
+        :return: {'last_page': 总页数, 'last_row': 总行数, 'data': [records]}
+        """
+        order = self.rows(sorters, filters)
+        rows = self.df.iloc[order[(page - 1) * size:page * size]]
+        rows = rows.astype(object).where(rows.notna(), None)
+        return {'last_page': max(int(np.ceil(len(order) / size)), 1), 'last_row': len(order),
+                'data': rows.to_dict(orient='records')}
+
+    def handle(self, handler, params: dict):
+        sorters, filters = _table_params(params)
+        page = int(params.get('page', [1])[0])
+        size = min(int(params.get('size', [100])[0]), 10000)
+        _send_json(handler, self.page(page, size, sorters, filters))
+
+
+class BarStream(object):
+    """
+    tick合并成K线，通过SSE推送给订阅的页面，每个连接每个帧间隔最多推送一次，推送期间更新过的K线合并发送
+    """
+
+    def __init__(self, freq: str = "1min", interval: float = 0.25, keep: int = 1000):
+        """
+        :param freq: K线周期 比如 1min 5min 1h 1D，按东八区时间对齐
+        :param interval: 推送帧间隔(秒)
+        :param keep: 保留最近多少根K线，新连接的页面先收到这些K线
+        """
+        self.freq = pd.Timedelta(freq).value // 1000000
+        self.interval = interval
+        self.keep = keep
+        self.bars = OrderedDict()
+        self.versions = {}
+        self.version = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.url = None
+
+    def _bar(self, time, price) -> dict:
+        """
+        取time所在周期的K线，新周期用price开盘，早于保留范围的返回None
+        """
+        timestamp = pd.Timestamp(time).value // 1000000 - 8 * 3600 * 1000
+        start = timestamp - (timestamp + 8 * 3600 * 1000) % self.freq
+        bar = self.bars.get(start)
+        if bar is None:
+            if len(self.bars) > 0 and start < next(iter(self.bars)):
+                return None
+            bar = {'timestamp': start,
+                   'time': json_type_convert(pd.Timestamp(start + 8 * 3600 * 1000, unit='ms')),
+                   'open': price, 'high': price, 'low': price, 'close': price, 'volume': 0.0}
+            self.bars[start] = bar
+            if len(self.bars) > 1 and start < next(reversed(self.bars)):
+                self.bars = OrderedDict(sorted(self.bars.items()))
+            while len(self.bars) > self.keep:
+                self.versions.pop(self.bars.popitem(last=False)[0], None)
+        return bar
+
+    def _updated(self, bar: dict):
+        self.version += 1
+        self.versions[bar['timestamp']] = self.version
+        self.condition.notify_all()
+
+    def push_tick(self, time, price: float, volume: float = 0.0):
+        """
+        推送一笔成交，合并到所在周期的K线
+        :param time: 成交时间
+        :param price: 成交价
+        :param volume: 成交量
+        """
+        with self.condition:
+            bar = self._bar(time, price)
+            if bar is None:
+                return
+            bar['high'] = max(bar['high'], price)
+            bar['low'] = min(bar['low'], price)
+            bar['close'] = price
+            bar['volume'] += volume
+            self._updated(bar)
+
+    def push_bar(self, time, open: float, high: float, low: float, close: float, volume: float = 0.0):
+        """
+        推送一根已经合并好的K线，覆盖同周期的K线
+        """
+        with self.condition:
+            bar = self._bar(time, open)
+            if bar is None:
+                return
+            bar.update({'open': open, 'high': high, 'low': low, 'close': close, 'volume': volume})
+            self._updated(bar)
+
+    def close(self):
+        """
+        结束推送，断开所有连接
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def handle(self, handler, params: dict):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        _send_cors(handler)
+        handler.end_headers()
+        seen = 0
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.version > seen or self.closed, timeout=15)
+                    if self.closed:
+                        return
+                    bars = [dict(bar) for timestamp, bar in self.bars.items() if self.versions[timestamp] > seen]
+                    seen = self.version
+                if len(bars) > 0:
+                    data = json.dumps(bars, ensure_ascii=False, separators=(',', ':'))
+                    handler.wfile.write(f"data: {data}\n\n".encode('utf-8'))
+                else:
+                    handler.wfile.write(b": keepalive\n\n")
+                handler.wfile.flush()
+                time.sleep(self.interval)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def _send_cors(handler):
+    """
+    默认不发跨域头(同源)，只有ChartServer显式设置allow_origin时才允许对应来源读取
+    """
+    allow_origin = handler.server.chart_server.allow_origin
+    if allow_origin:
+        handler.send_header('Access-Control-Allow-Origin', allow_origin)
+        if allow_origin != '*':
+            handler.send_header('Vary', 'Origin')
+
+
+def _send_json(handler, obj, status: int = 200):
+    body = json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=json_type_convert).encode('utf-8')
+    handler.send_response(status)
+    handler.send_header('Content-Type', 'application/json; charset=utf-8')
+    handler.send_header('Content-Length', str(len(body)))
+    _send_cors(handler)
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    路由格式 /<token>/<kind>/<name>?参数，token不对一律404，交给ChartServer里注册的处理对象
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server.chart_server
+        parts = [unquote(p) for p in url.path.strip('/').split('/', 2)]
+        route = None
+        if len(parts) == 3 and hmac.compare_digest(parts[0], server.token):
+            route = server.routes.get((parts[1], parts[2]))
+        if route is None:
+            _send_json(self, {'error': 'not found'}, 404)
+            return
+        try:
+            route.handle(self, parse_qs(url.query))
+        except (ValueError, KeyError) as e:
+            _send_json(self, {'error': str(e)}, 400)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ChartServer(object):
+    """
+    本地http数据服务，后台线程运行，给页面中的图表按需提供数据(历史K线分页、实时K线推送、表格远程分页等)
+    数据地址带每个服务随机生成的token，其他网页猜不到地址，无法探测读取本机数据
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, allow_origin: str = None):
+        """
+        :param host: 监听地址,默认只监听本机
+        :param port: 端口，0表示自动分配
+        :param allow_origin: 允许跨域读取的来源，比如 "http://localhost:8888"(notebook页面和数据服务端口不同)，默认只允许同源
+        """
+        self.allow_origin = allow_origin
+        self.token = secrets.token_urlsafe(16)
+        self.routes = {}
+        self.httpd = ThreadingHTTPServer((host, port), _RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.chart_server = self
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _add_route(self, kind: str, name: str, route) -> str:
+        name = name or uuid.uuid4().hex
+        self.routes[(kind, name)] = route
+        return f"{self.url}/{self.token}/{kind}/{quote(name, safe='')}"
+
+    def add_kline_store(self, data, name: str = None) -> str:
+        """
+        注册K线历史数据，返回的地址传给 KlineCharts(data_url=...) 分页加载
+        :param data: DataFrame/parquet文件/npz文件, 包含[timestamp,open,high,low,close,volume,turnover]
+        :param name: 路由名称，比如股票代码，默认随机
+        :return: 数据地址, GET ?before=毫秒时间戳&limit=条数 返回按列的json
+        """
+        return self._add_route("kline", name, _KlineStore(data))
+
+    def add_table(self, df: pd.DataFrame, name: str = None) -> str:
+        """
+        注册表格数据，返回的地址传给 Tabulator(data_url=...) 远程分页、排序、过滤
+        :param df: 表格数据
+        :param name: 路由名称，默认随机
+        :return: 数据地址
+        """
+        return self._add_route("table", name, _TableStore(df))
+
+    def add_bar_stream(self, name: str = None, freq: str = "1min", interval: float = 0.25,
+                       keep: int = 1000) -> BarStream:
+        """
+        注册实时K线推送，stream.url 传给 KlineCharts(stream_url=...) 或 candlestick_echarts(stream_url=...)
+        :param name: 路由名称，比如股票代码，默认随机
+        :param freq: K线周期
+        :param interval: 推送帧间隔(秒)
+        :param keep: 保留最近多少根K线
+        :return: BarStream, 调用 push_tick/push_bar 推送数据
+        """
+        stream = BarStream(freq=freq, interval=interval, keep=keep)
+        stream.url = self._add_route("stream", name, stream)
+        return stream
+
+    def stop(self):
+        """
+        停止服务
+        """
+        for route in self.routes.values():
+            if isinstance(route, BarStream):
+                route.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
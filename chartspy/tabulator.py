@@ -47,23 +47,34 @@ def tabulator_segment(plot):
                 $(cell.getElement()).sparkline(cell.getValue(), {{width:"100%", type:"discrete"}});
             }});
         }};
-        var tabledata = {plot.tabledata};
         var table = new Tabulator("#{plot.plot_id}", {{
             height:{plot.height},
-            data:tabledata,
+            """ + tabulator_data_options(plot) + f"""
             layout:"fitColumns",
             columns:{plot.columns},
         }});
         """
 
 
+def tabulator_data_options(plot):
+    if plot.data_url is None:
+        return f"""data:{plot.tabledata},"""
+    if plot.progressive:
+        paging = f"""progressiveLoad:"scroll", paginationSize:{plot.page_size},"""
+    else:
+        paging = f"""pagination:true, paginationMode:"remote", paginationSize:{plot.page_size},"""
+    return f"""ajaxURL:"{plot.data_url}", {paging}
+            sortMode:"remote", filterMode:"remote","""
+
+
 class Tabulator(object):
     """
     g2plot
     """
 
     def __init__(self, df: pd.DataFrame, sparkline_dict=None, width_dict=None, formatter_dict=None,
-                 height: str = "500"):
+                 height: str = "500", data_url: str = None, page_size: int = 100, progressive: bool = False,
+                 columnar: bool = False, extra_js: str = ""):
         """
         tabulator
         :param df: []
@@ -71,11 +82,26 @@ class Tabulator(object):
         :param width_dict: {'col':'120'}
         :param formatter_dict: {'col':'progress/star/tickCross/color'}
         :param height:500
+        :param data_url: 远程模式数据地址(ChartServer.add_table返回值)，df只用来生成列，翻页/排序/过滤都在服务端完成
+        :param page_size: 远程模式每页条数
+        :param progressive: 远程模式下滚动加载代替分页
+        :param columnar: 按列编码表格数据，数值列二进制传输，重复多的字符串列字典编码，浏览器端还原成行
+        :param extra_js:
         """
-        self.tabledata = Tools.convert_dict_to_js(df.to_dict(orient='records'))
+        self.data_url = data_url
+        self.page_size = page_size
+        self.progressive = progressive
+        self.extra_js = extra_js
+        if data_url is None:
+            if columnar:
+                self.tabledata = Tools.columnar_js(df)
+            else:
+                self.tabledata = Tools.convert_dict_to_js(df.to_dict(orient='records'))
         cols = []
         for col in df.columns:
             column = {'title': col, 'field': col}
+            if data_url is not None:
+                column['headerFilter'] = True
             if sparkline_dict is not None and col in sparkline_dict.keys():
                 column['formatter'] = Js(sparkline_dict[col] + "Formatter")
             if width_dict is not None and col in width_dict.keys():
@@ -91,13 +117,22 @@ class Tabulator(object):
         self.width = "100%"
 
     @staticmethod
-    def reduce_dataframe(df: pd.DataFrame, reduce_axis='index'):
+    def reduce_dataframe(df: pd.DataFrame, reduce_axis='index', max_points: int = None, how: str = 'line'):
         """
         :param df: 示例 pd.DataFrame(index=['2021-01-01','2021-01-02'],columns=['000001.SZ','000002.SZ'])
         :param reduce_axis: index按索引方向合并值到数组，columns 按列方向合并值到数组
+        :param max_points: 每个数组最多保留的点数，一般取单元格像素宽度，超过时分桶降采样
+        :param how: 降采样方式 line:每桶保留最小最大值 bar:每桶求和
         :return:
         """
-        return df.apply(lambda s: s.tolist(), axis=reduce_axis, result_type='reduce')
+        values = df.to_numpy()
+        if reduce_axis in ('index', 0):
+            values, index = values.T, df.columns
+        else:
+            index = df.index
+        if max_points is not None and values.shape[1] > max_points:
+            values = Tools.bucket_downsample(values, max_points, how='sum' if how == 'bar' else 'minmax')
+        return pd.Series(values.tolist(), index=index, dtype=object)
 
     def render_notebook(self) -> Html:
         """
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding=utf-8
+import base64
+import json
+import math
+import shutil
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from chartspy import Tabulator, Tools
+
+
+def _frame() -> pd.DataFrame:
+    n = 40
+    rng = np.random.default_rng(0)
+    trend = [rng.normal(size=8).round(3).tolist() for _ in range(n)]
+    trend[0] = None
+    trend[1] = np.nan
+    return pd.DataFrame({
+        'code': [f"{i % 7:06d}.SZ" for i in range(n)],
+        'name': [f'股票"{i}"\n' for i in range(n)],
+        'price': np.where(np.arange(n) % 9 == 0, np.nan, rng.uniform(1, 100, n).round(2)),
+        'volume': rng.integers(0, 10 ** 6, n),
+        'big': rng.integers(0, 10 ** 6, n) * 10 ** 8,
+        'up': rng.random(n) > 0.5,
+        'date': pd.date_range('2022-01-01', periods=4).repeat(10),
+        'trend': trend,
+    })
+
+
+def _decode_columnar(js: str) -> list:
+    """
+    python 实现的 Tools.columnar_js 解码，和浏览器端的 IIFE 逻辑一致
+    """
+    payload, n = js.rsplit('})(', 1)[1].rsplit(', ', 1)
+    cols, n = json.loads(payload), int(n.rstrip(')'))
+    arrays = {}
+    for name, c in cols.items():
+        if c[0] in ('f8', 'f4', 'i4'):
+            arrays[name] = np.frombuffer(base64.b64decode(c[1]), dtype='<' + c[0]).tolist()
+        elif c[0] == 'b1':
+            arrays[name] = [v == 1 for v in np.frombuffer(base64.b64decode(c[1]), dtype='u1')]
+        elif c[0] == 'dict':
+            codes = np.frombuffer(base64.b64decode(c[2]), dtype='<i4')
+            arrays[name] = [None if v < 0 else c[1][v] for v in codes]
+        else:
+            arrays[name] = c[1]
+    return [{name: arrays[name][i] for name in cols} for i in range(n)]
+
+
+def _records(df: pd.DataFrame) -> list:
+    return json.loads(Tools.convert_dict_to_js(df.to_dict(orient='records')))
+
+
+def _normalize(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _sort_order(rows: list, field: str) -> list:
+    # 和 tabulator 一样，空值排在最后
+    keys = [_normalize(row[field]) for row in rows]
+    return sorted(range(len(rows)), key=lambda i: (keys[i] is None, str(keys[i]) if isinstance(keys[i], list)
+                                                  else keys[i] if keys[i] is not None else 0))
+
+
+def test_columnar_rows_match_records():
+    df = _frame()
+    rows = _decode_columnar(Tools.columnar_js(df))
+    records = _records(df)
+    assert [{k: _normalize(v) for k, v in row.items()} for row in rows] == \
+           [{k: _normalize(v) for k, v in row.items()} for row in records]
+
+
+def test_columnar_sort_matches_records():
+    df = _frame()
+    rows = _decode_columnar(Tools.columnar_js(df))
+    records = _records(df)
+    for field in ['code', 'name', 'price', 'volume', 'big', 'up', 'date']:
+        assert _sort_order(rows, field) == _sort_order(records, field), field
+
+
+def test_columnar_encodes_compact_kinds():
+    cols = json.loads(Tools.columnar_js(_frame()).rsplit('})(', 1)[1].rsplit(', ', 1)[0])
+    assert cols['price'][0] == 'f8'
+    assert cols['volume'][0] == 'i4'
+    assert cols['big'][0] == 'f8'
+    assert cols['up'][0] == 'b1'
+    assert cols['code'][0] == 'dict'
+    assert cols['date'][0] == 'dict'
+    assert cols['trend'][0] == 'json'
+
+
+def test_columnar_list_column_with_missing_head():
+    df = pd.DataFrame({'trend': [None, np.nan, [1, 2], [3, 4]] * 3})
+    cols = json.loads(Tools.columnar_js(df).rsplit('})(', 1)[1].rsplit(', ', 1)[0])
+    assert cols['trend'][0] == 'json'
+    assert [_normalize(v) for v in cols['trend'][1]] == [None, None, [1, 2], [3, 4]] * 3
+
+
+def test_columnar_formatter_and_sparkline_columns_unchanged():
+    df = _frame()
+    options = dict(sparkline_dict={'trend': 'line'}, width_dict={'name': '120'},
+                   formatter_dict={'price': 'progress', 'up': 'tickCross'})
+    rows = Tabulator(df, **options)
+    columnar = Tabulator(df, columnar=True, **options)
+    assert columnar.columns == rows.columns
+    assert 'lineFormatter' in columnar.columns
+    html = columnar.render_html()
+    assert 'lineFormatter' in html and columnar.tabledata in html
+    decoded = _decode_columnar(columnar.tabledata)
+    assert [_normalize(row['trend']) for row in decoded] == [_normalize(v) for v in df['trend']]
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason="需要node执行解码js")
+def test_columnar_js_runs_in_node():
+    df = _frame()
+    script = "var atob = function(s){ return Buffer.from(s, 'base64').toString('binary'); };\n" \
+             f"process.stdout.write(JSON.stringify({Tools.columnar_js(df)}));"
+    output = subprocess.run(['node', '-e', script], capture_output=True, check=True, text=True).stdout
+    rows = json.loads(output)
+    assert [{k: _normalize(v) for k, v in row.items()} for row in rows] == \
+           [{k: _normalize(v) for k, v in row.items()} for row in _records(df)]